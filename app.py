@@ -1,13 +1,19 @@
 import os
 
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta, timezone
 from io import BytesIO
 import base64
 from calendar import monthrange
 import requests
 import json
+import multiprocessing
+import threading
 import time
 
+import numpy as np
 import pandas as pd
 import math
 import matplotlib
@@ -31,6 +37,7 @@ from markupsafe import Markup
 from werkzeug.utils import secure_filename
 from database import (
     UPLOAD_FOLDER,
+    SNAPSHOT_FOLDER,
     get_db,
     get_setting,
     add_log,
@@ -39,9 +46,19 @@ from database import (
     get_api_responses,
     set_setting,
     set_settings,
+    get_data_version,
+    bump_data_version,
+    ensure_transaction_indexes,
+    ensure_line_hashes,
+    ensure_sku_keys,
+    index_duplicate_candidates,
+    pool_stats,
 )
 
 from utils.sync import upsert_record
+from utils.cache import LRUCache
+from utils.ingest import created_datetime, timestamp_parts
+from utils.snapshot import load_snapshot
 from utils.shopify_api import fetch_shopify_api, fetch_shopify_list
 from utils.qbo_api import fetch_qbo_api, qbo_api_url, refresh_qbo_access
 from utils.pdf_utils import create_pdf
@@ -50,8 +67,14 @@ from utils.helpers import (
     _is_dark_color,
     _chart_style,
     _try_read_csv,
-    _parse_shopify,
-    _parse_qbo,
+    _stream_shopify,
+    _stream_qbo,
+    _load_staging,
+    _drop_staging,
+    _parse_upload,
+    _read_sku_map,
+    _file_digest,
+    CSVEncodingError,
     format_dt,
     trend,
     format_minutes,
@@ -185,6 +208,19 @@ HUBSPOT_SOURCE_MAP = {
     "PAID_SEARCHES": "Paid Search",
 }
 
+# Computed report data keyed on (year, month, data version)
+REPORT_CACHE = LRUCache(maxsize=32)
+
+# Where report summaries are aggregated: the precomputed monthly rollup,
+# GROUP BY queries over the raw transaction tables or the columnar snapshot
+REPORT_BACKENDS = ("rollup", "sqlite", "snapshot")
+
+# Year windows offered under Settings → Reports; the HubSpot sync
+# precomputes a traffic matrix for each of them
+TRAFFIC_YEAR_LIMITS = (1, 2, 5, 10)
+_TRAFFIC_REFRESHING = set()
+_TRAFFIC_REFRESH_LOCK = threading.Lock()
+
 app.jinja_env.filters["format_dt"] = format_dt
 app.jinja_env.filters["trend"] = trend
 app.jinja_env.filters["format_minutes"] = format_minutes
@@ -247,6 +283,109 @@ def dashboard():
     )
 
 
+# Shopify CSV and QuickBooks workbook uploads larger than these are loaded in
+# chunks of ``UPLOAD_CHUNK_ROWS`` rows instead of being parsed in one piece.
+# Workbooks are compressed, so their threshold is lower.
+SHOPIFY_STREAM_BYTES = 16 * 1024 * 1024
+QBO_STREAM_BYTES = 4 * 1024 * 1024
+UPLOAD_CHUNK_ROWS = 50_000
+
+
+def _stream_upload(file_storage, source):
+    """Return True if ``file_storage`` should be ingested in chunks."""
+    if source == "shopify":
+        extensions, limit = (".csv",), SHOPIFY_STREAM_BYTES
+    elif source == "qbo":
+        extensions, limit = (".xlsx",), QBO_STREAM_BYTES
+    else:
+        return False
+    if not file_storage.filename.lower().endswith(extensions):
+        return False
+    file_storage.seek(0, os.SEEK_END)
+    size = file_storage.tell()
+    file_storage.seek(0)
+    return size > limit
+
+
+# Order in which the files of one upload are applied. The SKU map goes first
+# so aliases in the transaction files are checked against the new map; files
+# of the same source keep the order they were submitted in.
+UPLOAD_ORDER = ("sku_map", "sku_map_merge", "shopify", "qbo")
+
+_PARSE_POOL = None
+_PARSE_POOL_LOCK = threading.Lock()
+
+
+def _parse_pool(broken=None):
+    """Return the process pool that parses multi-file uploads.
+
+    A worker that died (e.g. out of memory) leaves its pool unusable; pass
+    that pool as ``broken`` to replace it. Other threads that saw the same
+    pool break get the replacement rather than a second new pool.
+    """
+    global _PARSE_POOL
+    with _PARSE_POOL_LOCK:
+        if _PARSE_POOL is None or _PARSE_POOL is broken:
+            if broken is not None:
+                broken.shutdown(wait=False)
+            _PARSE_POOL = ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1))
+        return _PARSE_POOL
+
+
+def _submit_parse(job):
+    """Submit ``job`` to the parse pool, replacing the pool if it is broken.
+
+    Returns a callable that yields the result. If the pool breaks while the
+    job runs, the callable replaces the pool for later uploads and raises.
+    """
+    pool = _parse_pool()
+    try:
+        future = pool.submit(_parse_upload, *job)
+    except BrokenProcessPool:
+        pool = _parse_pool(broken=pool)
+        future = pool.submit(_parse_upload, *job)
+
+    def result():
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            _parse_pool(broken=pool)
+            raise
+
+    return result
+
+
+def _parse_files(jobs):
+    """Start parsing the ``(source, filename, data)`` of each job.
+
+    Returns a callable per job that yields ``_parse_upload``'s result, or None
+    for jobs without data (streamed files). When more than one file needs
+    parsing they run in the process pool, since pandas holds the GIL while
+    reading Excel; a single file is parsed inline.
+    """
+    if sum(1 for job in jobs if job[2] is not None) < 2:
+        return [
+            (lambda job=job: _parse_upload(*job)) if job[2] is not None else None
+            for job in jobs
+        ]
+    return [_submit_parse(job) if job[2] is not None else None for job in jobs]
+
+
+def _already_ingested(conn, source, digest, append):
+    """Return True if uploading the file with ``digest`` would change nothing.
+
+    ``uploads`` lists the files whose rows currently make up each source
+    table: a replace upload resets the list, an append adds to it and the API
+    syncs clear it. An append is redundant if the file is listed; a replace
+    only if it is the sole file listed.
+    """
+    digests = [
+        row["sha256"]
+        for row in conn.execute("SELECT sha256 FROM uploads WHERE source=?", (source,))
+    ]
+    return digest in digests if append else digests == [digest]
+
+
 @app.route("/upload", methods=["GET", "POST"])
 def upload():
     if request.method == "POST":
@@ -260,74 +399,140 @@ def upload():
         if not pairs:
             flash("Please provide a file and select its source.")
             return redirect(request.url)
-
+        for data_file, source in pairs:
+            if not data_file or not source:
+                flash("Please provide a file and select its source.")
+                return redirect(request.url)
+            if source not in UPLOAD_ORDER:
+                flash("Unknown source selected.")
+                return redirect(request.url)
+        pairs.sort(key=lambda pair: UPLOAD_ORDER.index(pair[1]))
+
+        append = bool(request.form.get("append"))
         conn = get_db()
+        digests = []
+        skipped = []
+        for data_file, source in list(pairs):
+            digest = _file_digest(data_file) if source in {"shopify", "qbo"} else None
+            if (
+                digest
+                and not request.form.get("force")
+                and _already_ingested(conn, source, digest, append)
+            ):
+                pairs.remove((data_file, source))
+                skipped.append(data_file.filename)
+            else:
+                digests.append(digest)
+        if skipped:
+            add_log(f"Upload skipped files already ingested: {', '.join(skipped)}")
+        if not pairs:
+            conn.close()
+            flash(
+                f"{', '.join(skipped)} already ingested; nothing to update. "
+                "Tick 'Re-import identical files' to load them again."
+            )
+            return redirect(url_for("dashboard"))
+        streamed = [_stream_upload(data_file, source) for data_file, source in pairs]
+        results = _parse_files(
+            [
+                (source, data_file.filename, None if stream else data_file.read())
+                for (data_file, source), stream in zip(pairs, streamed)
+            ]
+        )
+        new_aliases = 0
         try:
-            for data_file, source in pairs:
-                if not data_file or not source:
-                    flash("Please provide a file and select its source.")
-                    conn.close()
-                    return redirect(request.url)
-
-                if source == "shopify":
-                    cleaned = _parse_shopify(data_file)
-                    cleaned.to_sql("shopify", conn, if_exists="replace", index=False)
-                elif source == "qbo":
-                    cleaned = _parse_qbo(data_file)
-                    cleaned.to_sql("qbo", conn, if_exists="replace", index=False)
-                elif source == "sku_map":
-                    try:
-                        if data_file.filename.lower().endswith((".xls", ".xlsx")):
-                            df = pd.read_excel(data_file)
-                        else:
-                            df = pd.read_csv(data_file)
-                    except Exception:
-                        flash("Unable to parse SKU map file.")
-                        conn.close()
-                        return redirect(request.url)
-                    required = {"alias", "canonical_sku", "type"}
-                    if not required.issubset(df.columns):
-                        flash(
-                            "SKU map file must contain alias, canonical_sku and type columns."
-                        )
-                        conn.close()
-                        return redirect(request.url)
-                    if "source" not in df.columns:
-                        df["source"] = ""
-                    conn.execute("DELETE FROM sku_map")
-                    for row in df[
-                        ["alias", "canonical_sku", "type", "source"]
-                    ].itertuples(index=False):
-                        alias = str(row.alias).lower().strip()
-                        canonical = str(row.canonical_sku).lower().strip() or alias
-                        type_val = str(row.type).lower().strip() or "unmapped"
-                        source_val = (
-                            str(row.source).lower().strip()
-                            if hasattr(row, "source")
-                            else ""
+            _drop_staging(conn)
+            # Parse and stage every file first; pandas commits each to_sql, so
+            # nothing touches the live tables until all files have parsed.
+            staged = []
+            for number, ((data_file, source), result, digest) in enumerate(
+                zip(pairs, results, digests)
+            ):
+                name = data_file.filename
+
+                def log(message, name=name):
+                    add_log(f"Upload {name}: {message}", conn)
+
+                staging = f"{source}_staging_{number}"
+                if result is None:
+                    start = time.perf_counter()
+
+                    def progress(chunk, rows, log=log):
+                        log(f"loaded chunk {chunk} ({rows} rows)")
+
+                    if source == "shopify":
+                        rows = _stream_shopify(
+                            data_file,
+                            conn,
+                            staging,
+                            chunksize=UPLOAD_CHUNK_ROWS,
+                            progress=progress,
+                            log=log,
                         )
-                        conn.execute(
-                            "INSERT INTO sku_map(alias, canonical_sku, type, source, changed_at) VALUES(?,?,?,?,?)",
-                            (
-                                alias,
-                                canonical,
-                                type_val,
-                                source_val,
-                                datetime.now(timezone.utc).isoformat(),
-                            ),
+                    else:
+                        rows = _stream_qbo(
+                            data_file,
+                            conn,
+                            staging,
+                            chunksize=UPLOAD_CHUNK_ROWS,
+                            progress=progress,
                         )
-                    continue
+                    df, seconds = None, time.perf_counter() - start
                 else:
-                    flash("Unknown source selected.")
-                    conn.close()
-                    return redirect(request.url)
-
-                created = pd.to_datetime(
-                    cleaned["created_at"].astype(str),
-                    errors="coerce",
-                    format="mixed",
-                    utc=True,
-                ).dt.tz_localize(None)
+                    try:
+                        df, messages, seconds = result()
+                    except ValueError as exc:
+                        if source in {"sku_map", "sku_map_merge"}:
+                            flash(str(exc))
+                            conn.close()
+                            return redirect(request.url)
+                        raise
+                    for message in messages:
+                        log(message)
+                    rows = len(df)
+                    if source in {"shopify", "qbo"}:
+                        df.to_sql(staging, conn, if_exists="replace", index=False)
+                log(f"parsed {rows} rows in {seconds:.2f}s")
+                staged.append((name, source, staging, df, rows, seconds, digest))
+
+            if not conn.in_transaction:
+                conn.execute("BEGIN")
+            summary = []
+            for name, source, staging, df, rows, seconds, digest in staged:
+                note = f"{name}: {rows} rows in {seconds:.2f}s"
+                if source in {"sku_map", "sku_map_merge"}:
+                    _import_sku_map(conn, df, merge=source == "sku_map_merge")
+                    summary.append(note)
+                    continue
+                added = _load_staging(conn, source, staging, append)
+                ensure_sku_keys(conn, source)
+                index_duplicate_candidates(conn, source, rebuild=not append)
+                if not append:
+                    conn.execute("DELETE FROM uploads WHERE source=?", (source,))
+                conn.execute(
+                    "REPLACE INTO uploads(source, sha256, filename, rows, uploaded_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (
+                        source,
+                        digest,
+                        name,
+                        rows,
+                        datetime.now(timezone.utc).isoformat(),
+                    ),
+                )
+                if append:
+                    note += f", {added} new"
+                summary.append(note)
+                ensure_transaction_indexes(conn)
+                created_ts = pd.read_sql_query(
+                    f"SELECT MIN(created_ts) AS ts FROM {source} "
+                    f"UNION ALL SELECT MAX(created_ts) FROM {source}",
+                    conn,
+                )["ts"]
+                skus = pd.read_sql_query(f"SELECT DISTINCT sku FROM {source}", conn)[
+                    "sku"
+                ]
+                created = created_datetime(created_ts)
                 last_txn = created.max()
                 first_txn = created.min()
                 row = conn.execute(
@@ -344,14 +549,29 @@ def upload():
                         last_synced,
                     ),
                 )
-                _update_sku_map(conn, cleaned["sku"], source)
+                new_aliases += _update_sku_map(conn, skus, source)
+            bump_data_version(conn, "transactions")
+            _rebuild_rollup(conn)
             action = get_setting("duplicate_action", "review")
             if action in {"shopify", "qbo", "both"}:
                 _resolve_duplicates(conn, action)
+            bump_data_version(conn)
             conn.commit()
-            flash("File uploaded and data updated.")
+            message = f"File uploaded and data updated. {'; '.join(summary)}."
+            if skipped:
+                message += f" Skipped {', '.join(skipped)} (already ingested)."
+            if new_aliases:
+                message += (
+                    f" {new_aliases} new SKU "
+                    f"alias{'es' if new_aliases != 1 else ''} added."
+                )
+            flash(message)
             conn.close()
             return redirect(url_for("dashboard"))
+        except CSVEncodingError as exc:
+            flash(f"Failed to process file: {exc}")
+            conn.close()
+            return render_template("upload.html")
         except ValueError:
             flash("Failed to process file: Invalid data")
             conn.close()
@@ -364,20 +584,492 @@ def upload():
 
 
 def _update_sku_map(conn, sku_series, source=None):
-    aliases = sku_series.dropna().str.lower().str.strip().unique()
-    for alias in aliases:
-        row = conn.execute("SELECT 1 FROM sku_map WHERE alias=?", (alias,)).fetchone()
-        if not row:
+    """Add unseen SKUs from ``sku_series`` to ``sku_map`` as unmapped aliases.
+
+    New aliases are found with one set difference against the existing map
+    and written with a single ``executemany``. Returns the number added.
+    """
+    aliases = set(sku_series.dropna().str.lower().str.strip().dropna())
+    existing = {row[0] for row in conn.execute("SELECT alias FROM sku_map")}
+    new = sorted(aliases - existing)
+    if new:
+        now = datetime.now(timezone.utc).isoformat()
+        conn.executemany(
+            "INSERT OR IGNORE INTO sku_map(alias, canonical_sku, type, source, changed_at) VALUES(?,?,?,?,?)",
+            [(alias, alias, "unmapped", source, now) for alias in new],
+        )
+    return len(new)
+
+
+def _resolve_skus(skus, mapping):
+    """Return ``(canonical, type)`` Series for a column of raw SKUs.
+
+    Each distinct SKU is normalized once (lowercased and stripped) and looked
+    up in ``mapping`` with a single vectorized lookup, so the cost scales with
+    the number of distinct SKUs rather than with the number of rows. SKUs
+    missing from the map resolve to themselves with type ``unmapped``;
+    non-string values are passed through unchanged.
+    """
+    codes, uniques = pd.factorize(skus)
+    raw = pd.Series(uniques, dtype=object)
+    keys = raw.where(raw.map(type).eq(str)).str.lower().str.strip()
+
+    lookup = mapping.assign(alias=mapping["alias"].str.lower()).drop_duplicates(
+        "alias"
+    )
+    lookup = lookup.set_index("alias")
+    key_vals = keys.to_numpy(dtype=object)
+    canonical = keys.map(lookup["canonical_sku"]).to_numpy(dtype=object)
+    canonical = np.where(pd.isna(canonical), key_vals, canonical)
+    canonical = np.where(pd.isna(key_vals), raw.to_numpy(dtype=object), canonical)
+    if "type" in lookup.columns:
+        types = keys.map(lookup["type"]).to_numpy(dtype=object)
+        types = np.where(pd.isna(types), "unmapped", types)
+    else:
+        types = np.full(len(raw), "unmapped", dtype=object)
+
+    # code -1 marks missing SKUs; append a trailing slot so indexing maps it
+    canonical = np.append(canonical, np.nan).astype(object)
+    types = np.append(types, "unmapped").astype(object)
+    return (
+        pd.Series(canonical[codes], index=skus.index, dtype=object),
+        pd.Series(types[codes], index=skus.index, dtype=object),
+    )
+
+
+def _rollup_frame(conn, frames):
+    """Aggregate transaction rows into ``monthly_rollup`` shaped records.
+
+    ``frames`` maps a source name to a DataFrame with ``year``, ``month``,
+    ``sku``, ``quantity`` and ``total`` columns.
+    """
+    mapping = pd.read_sql_query("SELECT alias, canonical_sku, type FROM sku_map", conn)
+    parts = []
+    for source, df in frames.items():
+        parts.append(
+            df[["year", "month", "sku", "quantity", "total"]].assign(source=source)
+        )
+    all_data = _safe_concat(parts, ignore_index=True)
+    if all_data.empty:
+        return []
+
+    all_data["total"] = pd.to_numeric(all_data["total"], errors="coerce").fillna(0)
+    all_data["quantity"] = pd.to_numeric(all_data["quantity"], errors="coerce").fillna(
+        0
+    )
+    all_data = all_data.dropna(subset=["year", "month"])
+
+    all_data["canonical"], all_data["type"] = _resolve_skus(all_data["sku"], mapping)
+
+    grouped = (
+        all_data.groupby(["year", "month", "canonical", "type", "source"], dropna=False)
+        .agg({"total": "sum", "quantity": "sum"})
+        .reset_index()
+    )
+    return [
+        (
+            int(r.year),
+            int(r.month),
+            None if pd.isna(r.canonical) else r.canonical,
+            r.type,
+            r.source,
+            float(r.total),
+            float(r.quantity),
+        )
+        for r in grouped.itertuples(index=False)
+    ]
+
+
+def _rebuild_rollup(conn):
+    """Recompute ``monthly_rollup`` from the Shopify and QBO tables.
+
+    Called after any write that can move totals between months, SKUs or
+    types (uploads, syncs and SKU map edits). The caller commits.
+    """
+    frames = {
+        source: pd.read_sql_query(
+            f"SELECT year, month, sku, quantity, total FROM {source}", conn
+        )
+        for source in ("shopify", "qbo")
+    }
+    records = _rollup_frame(conn, frames)
+    conn.execute("DELETE FROM monthly_rollup")
+    conn.executemany(
+        "INSERT INTO monthly_rollup(year, month, canonical_sku, type, source, total, quantity) "
+        "VALUES (?,?,?,?,?,?,?)",
+        records,
+    )
+    _stamp_rollup(conn)
+
+
+def _stamp_rollup(conn):
+    """Record that ``monthly_rollup`` matches the current transaction tables.
+
+    Writers of the Shopify and QBO tables bump the ``transactions`` version
+    and then update the rollup in the same transaction; ``_ensure_rollup``
+    rebuilds the rollup whenever the stamp has fallen behind.
+    """
+    conn.execute(
+        "INSERT INTO data_version(name, version) VALUES ('rollup', ?) "
+        "ON CONFLICT(name) DO UPDATE SET version=excluded.version",
+        (get_data_version("transactions", conn=conn),),
+    )
+
+
+# Most ids bound into one ``IN (...)``, kept under SQLite's variable limit
+SQL_IN_BATCH = 900
+
+
+def _id_batches(ids):
+    """Yield the distinct ``ids`` in sorted lists of at most ``SQL_IN_BATCH``."""
+    ids = sorted({int(i) for i in ids})
+    for pos in range(0, len(ids), SQL_IN_BATCH):
+        yield ids[pos : pos + SQL_IN_BATCH]
+
+
+def _adjust_rollup(conn, source, rowids, sign):
+    """Add (``sign=1``) or subtract (``sign=-1``) rows from ``monthly_rollup``.
+
+    Used for inserts and deletes of known rows, such as resolving a duplicate
+    or appending a sync page, so they do not require a full rebuild.
+    Subtractions must run before the rows are deleted.
+    """
+    frames = [
+        pd.read_sql_query(
+            f"SELECT year, month, sku, quantity, total FROM {source} "
+            f"WHERE rowid IN ({','.join('?' * len(batch))})",
+            conn,
+            params=batch,
+        )
+        for batch in _id_batches(rowids)
+    ]
+    records = (
+        _rollup_frame(conn, {source: pd.concat(frames, ignore_index=True)})
+        if frames
+        else []
+    )
+    for year, month, canonical, type_val, src, total, qty in records:
+        cur = conn.execute(
+            "UPDATE monthly_rollup SET total=total+?, quantity=quantity+? "
+            "WHERE year=? AND month=? AND canonical_sku IS ? AND type=? AND source=?",
+            (sign * total, sign * qty, year, month, canonical, type_val, src),
+        )
+        if cur.rowcount == 0:
             conn.execute(
-                "INSERT INTO sku_map(alias, canonical_sku, type, source, changed_at) VALUES(?,?,?,?,?)",
-                (
-                    alias,
-                    alias,
-                    "unmapped",
-                    source,
-                    datetime.now(timezone.utc).isoformat(),
-                ),
+                "INSERT INTO monthly_rollup(year, month, canonical_sku, type, source, total, quantity) "
+                "VALUES (?,?,?,?,?,?,?)",
+                (year, month, canonical, type_val, src, sign * total, sign * qty),
             )
+    _stamp_rollup(conn)
+
+
+_ROLLUP_COLUMNS = {
+    "year": "year",
+    "month_num": "month",
+    "canonical": "canonical_sku",
+    "type": "type",
+    "source": "source",
+}
+
+
+def _sync_rollup(conn, source, appended_after=None):
+    """Bring ``monthly_rollup`` up to date after a sync page wrote ``source``.
+
+    A page that replaced the table rebuilds the rollup; later pages append,
+    so only their rows above ``appended_after`` are added. Keeping the rollup
+    current page by page means a sync that stops partway leaves reports
+    consistent with the rows written so far.
+    """
+    bump_data_version(conn, "transactions")
+    if appended_after is None:
+        _rebuild_rollup(conn)
+        return
+    rowids = [
+        row[0]
+        for row in conn.execute(
+            f"SELECT rowid FROM {source} WHERE rowid > ?", (appended_after,)
+        )
+    ]
+    _adjust_rollup(conn, source, rowids, 1)
+
+
+def _ensure_rollup(conn):
+    """Rebuild ``monthly_rollup`` if it is behind the transaction tables.
+
+    The rollup is stamped with the ``transactions`` version it reflects, so a
+    write that changed the tables without updating it (e.g. a sync that
+    stopped partway under an older version) is caught here.
+    """
+    if get_data_version("rollup", conn=conn) == get_data_version(
+        "transactions", conn=conn
+    ):
+        return
+    _rebuild_rollup(conn)
+    conn.commit()
+
+
+def _load_rollup(
+    conn, years=None, month=None, before=None, source=None, group_by=None
+):
+    """Return ``monthly_rollup`` rows, building the table on first use.
+
+    Filters are applied in SQLite against the table's ``(year, month, ...)``
+    key so only the requested slice is read.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Database connection.
+    years : iterable of int, optional
+        Only include these years.
+    month : int, optional
+        Only include this month number.
+    before : int, optional
+        Only include years earlier than this one.
+    source : str, optional
+        Only include rows from ``"shopify"`` or ``"qbo"``.
+    group_by : list of str, optional
+        Sum ``total`` and ``quantity`` over these output columns instead of
+        returning one row per rollup entry.
+    """
+    _ensure_rollup(conn)
+    clauses = []
+    params = []
+    if years is not None:
+        years = sorted({int(y) for y in years})
+        clauses.append(f"year IN ({','.join('?' * len(years))})")
+        params.extend(years)
+    if month is not None:
+        clauses.append("month=?")
+        params.append(int(month))
+    if before is not None:
+        clauses.append("year<?")
+        params.append(int(before))
+    if source is not None:
+        clauses.append("source=?")
+        params.append(source)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    if group_by:
+        keys = ", ".join(f"{_ROLLUP_COLUMNS[c]} AS {c}" for c in group_by)
+        groups = ", ".join(_ROLLUP_COLUMNS[c] for c in group_by)
+        query = (
+            f"SELECT {keys}, SUM(total) AS total, SUM(quantity) AS quantity "
+            f"FROM monthly_rollup{where} GROUP BY {groups}"
+        )
+    else:
+        query = (
+            "SELECT year, month AS month_num, canonical_sku AS canonical, type, "
+            f"source, total, quantity FROM monthly_rollup{where}"
+        )
+    rollup = pd.read_sql_query(query, conn, params=params)
+    if "month_num" in rollup.columns:
+        rollup["month"] = rollup["month_num"].map(
+            {i: m for i, m in enumerate(MONTHS_ORDER, start=1)}
+        )
+    return rollup
+
+
+# SQL expression for the canonical SKU of a row ``{c}`` with a ``sku_key``
+# column joined to its ``sku_map`` entry ``{m}`` on the normalized ``alias``;
+# mirrors ``_resolve_skus``
+_CANONICAL = (
+    "CASE WHEN typeof({c}.sku_key)='text' "
+    "THEN COALESCE({m}.canonical_sku, {c}.sku_key) ELSE {c}.sku_key END"
+)
+
+
+# SQL expression coercing column ``{col}`` to a number; only values stored
+# as text are passed to the ``to_number`` function
+_NUMBER = (
+    "CASE typeof({col}) WHEN 'integer' THEN {col} WHEN 'real' THEN {col} "
+    "WHEN 'text' THEN to_number({col}) END"
+)
+
+
+def _number(value):
+    """Coerce a text amount like ``pd.to_numeric(errors="coerce")`` would."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _query_summary(
+    conn, years=None, month=None, before=None, source=None, group_by=None
+):
+    """Aggregate the transaction tables in SQLite.
+
+    Accepts the same filters as ``_load_rollup`` and returns the same frame,
+    but groups the raw Shopify and QBO rows joined against ``sku_map``
+    instead of reading ``monthly_rollup``. Rows join on the ``sku_key``
+    stored at ingest and amounts are coerced in SQL, so Python is only
+    called for amounts stored as text.
+    """
+    conn.create_function("to_number", 1, _number, deterministic=True)
+    clauses = ["f.year IS NOT NULL", "f.month IS NOT NULL"]
+    params = []
+    if years is not None:
+        years = sorted({int(y) for y in years})
+        clauses.append(f"f.year IN ({','.join('?' * len(years))})")
+        params.extend(years)
+    if month is not None:
+        clauses.append("f.month=?")
+        params.append(int(month))
+    if before is not None:
+        clauses.append("f.year<?")
+        params.append(int(before))
+    where = " AND ".join(clauses)
+    sources = [source] if source else ["shopify", "qbo"]
+    facts = " UNION ALL ".join(
+        f"SELECT f.year, f.month, f.sku, f.sku_key, "
+        f"{_NUMBER.format(col='f.total')} AS total, "
+        f"{_NUMBER.format(col='f.quantity')} AS quantity, '{src}' AS source "
+        f"FROM {src} f WHERE {where}"
+        for src in sources
+    )
+
+    group_by = group_by or ["year", "month_num", "canonical", "type", "source"]
+    keys = ", ".join(f"{_ROLLUP_COLUMNS[c]} AS {c}" for c in group_by)
+    groups = ", ".join(_ROLLUP_COLUMNS[c] for c in group_by)
+    query = f"""
+        WITH t AS ({facts})
+        SELECT {keys},
+               SUM(COALESCE(total, 0)) AS total,
+               SUM(COALESCE(quantity, 0)) AS quantity
+        FROM (
+            SELECT t.year, t.month, t.source, t.total, t.quantity,
+                   CASE WHEN typeof(t.sku)='text'
+                        THEN COALESCE(m.canonical_sku, t.sku_key)
+                        ELSE t.sku END AS canonical_sku,
+                   CASE WHEN typeof(t.sku)='text'
+                        THEN COALESCE(m.type, 'unmapped')
+                        ELSE 'unmapped' END AS type
+            FROM t LEFT JOIN sku_map m ON m.alias = t.sku_key
+        )
+        GROUP BY {groups}
+    """
+    summary = pd.read_sql_query(query, conn, params=params * len(sources))
+    if "month_num" in summary.columns:
+        summary["month"] = summary["month_num"].map(
+            {i: m for i, m in enumerate(MONTHS_ORDER, start=1)}
+        )
+    return summary
+
+
+def _snapshot(conn):
+    """Return the columnar snapshot for the current data version."""
+    return load_snapshot(
+        conn,
+        SNAPSHOT_FOLDER,
+        get_data_version(conn=conn),
+        get_data_version("database", conn=conn),
+    )
+
+
+def _snapshot_frames(
+    conn,
+    columns,
+    years=None,
+    month=None,
+    before=None,
+    source=None,
+):
+    """Yield ``(source, DataFrame)`` slices of the snapshot with resolved SKUs.
+
+    SKUs are resolved once per dictionary entry rather than once per row.
+    Only ``columns`` are copied out of the memory-mapped arrays, and only for
+    rows passing the filters. Rows without a parsed date are skipped.
+    """
+    snap = _snapshot(conn)
+    mapping = pd.read_sql_query("SELECT alias, canonical_sku, type FROM sku_map", conn)
+    for src in [source] if source else ["shopify", "qbo"]:
+        cols = snap.columns[src]
+        mask = (cols["year"] != 0) & (cols["month"] != 0)
+        if years is not None:
+            mask &= np.isin(cols["year"], [int(y) for y in years])
+        if month is not None:
+            mask &= cols["month"] == int(month)
+        if before is not None:
+            mask &= cols["year"] < int(before)
+        canonical, types = _resolve_skus(
+            pd.Series(snap.skus[src], dtype=object), mapping
+        )
+        # code -1 marks missing SKUs; the trailing slot resolves them
+        canonical = np.append(canonical.to_numpy(dtype=object), np.nan)
+        types = np.append(types.to_numpy(dtype=object), "unmapped")
+        codes = cols["sku"][mask]
+        frame = {}
+        for col in columns:
+            if col == "canonical":
+                frame[col] = canonical[codes]
+            elif col == "type":
+                frame[col] = types[codes]
+            elif col == "month_num":
+                frame[col] = cols["month"][mask].astype(np.int64)
+            elif col == "year":
+                frame[col] = cols["year"][mask].astype(np.int64)
+            else:
+                frame[col] = np.nan_to_num(cols[col][mask], nan=0.0)
+        yield src, pd.DataFrame(frame)
+
+
+def _snapshot_summary(
+    conn, years=None, month=None, before=None, source=None, group_by=None
+):
+    """Aggregate the columnar snapshot like ``_load_rollup`` does."""
+    group_by = group_by or ["year", "month_num", "canonical", "type", "source"]
+    keys = [c for c in group_by if c != "source"]
+    frames = [
+        df.assign(source=src)
+        for src, df in _snapshot_frames(
+            conn, keys + ["total", "quantity"], years, month, before, source
+        )
+    ]
+    summary = (
+        _safe_concat(frames, ignore_index=True)
+        .groupby(group_by, dropna=False)[["total", "quantity"]]
+        .sum()
+        .reset_index()
+    )
+    if "month_num" in summary.columns:
+        summary["month"] = summary["month_num"].map(
+            {i: m for i, m in enumerate(MONTHS_ORDER, start=1)}
+        )
+    return summary
+
+
+def _load_summary(conn, backend=None, **filters):
+    """Return report totals from the configured ``report_backend``."""
+    backend = backend or _report_backend()
+    if backend == "sqlite":
+        return _query_summary(conn, **filters)
+    if backend == "snapshot":
+        return _snapshot_summary(conn, **filters)
+    return _load_rollup(conn, **filters)
+
+
+def _report_backend():
+    backend = get_setting("report_backend", "rollup")
+    return backend if backend in REPORT_BACKENDS else "rollup"
+
+
+def _created_range(start=None, end=None, column="created_ts"):
+    """Return a SQL condition and params bounding ``created_ts``.
+
+    ``start`` and ``end`` are naive UTC datetimes matched inclusively, the
+    same way the pages compare parsed ``created_at`` values. ``column`` names
+    the timestamp column when the query joins several tables.
+    """
+    clauses = [f"{column} IS NOT NULL"]
+    params = []
+    if start is not None:
+        clauses.append(f"{column} >= ?")
+        params.append(math.ceil((start - datetime(1970, 1, 1)).total_seconds()))
+    if end is not None:
+        clauses.append(f"{column} <= ?")
+        params.append(math.floor((end - datetime(1970, 1, 1)).total_seconds()))
+    return " AND ".join(clauses), params
 
 
 def _save_types(conn, form):
@@ -394,15 +1086,49 @@ def _save_types(conn, form):
 
 def _resolve_duplicates(conn, action):
     """Resolve duplicate transactions between Shopify and QBO."""
-    pairs = _find_duplicates(conn)
-    for p in pairs:
-        if p.get("unmatched"):
-            continue
-        conn.execute(
-            "INSERT INTO duplicate_log(resolved_at, shopify_id, qbo_id, action, sku, shopify_sku, qbo_sku, quantity, total, shopify_desc, qbo_desc, created_at, shopify_created_at, qbo_created_at, ignored) "
-            "VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,0)",
+    pairs = [p for p in _find_duplicates(conn) if not p.get("unmatched")]
+    return _apply_resolutions(conn, [(p, action) for p in pairs])
+
+
+def _resolve_duplicate_pair(conn, sid, qid, action):
+    """Resolve a specific duplicate pair."""
+    pair = next(iter(_find_duplicates(conn, pair=(sid, qid))), None)
+    if not pair:
+        return
+    conn.execute(
+        "UPDATE duplicate_log SET ignored=0 WHERE shopify_id=? AND qbo_id=?", (sid, qid)
+    )
+    _apply_resolutions(conn, [(pair, action)])
+
+
+# Table whose row a duplicate resolution action deletes
+_DISCARDED = {"shopify": "qbo", "qbo": "shopify"}
+
+
+def _apply_resolutions(conn, resolutions):
+    """Log and apply ``(pair, action)`` resolutions as one batch.
+
+    ``pair`` is a row from ``_find_duplicates``. The log is written with one
+    ``executemany`` and the discarded rows are removed with set-based deletes
+    of ``SQL_IN_BATCH`` ids at a time. Each log entry keeps the ``line_hash``
+    of the row it deleted so appending an overlapping export does not bring
+    the row back, and the row's own ``created_at`` and SKU so unmatching
+    restores it as it was. Returns the number of rows deleted from each
+    table.
+    """
+    drop = {table: set() for table in _DISCARDED.values()}
+    for p, action in resolutions:
+        if action in _DISCARDED:
+            drop[_DISCARDED[action]].add(p[f"{_DISCARDED[action]}_id"])
+    hashes = {table: _line_hashes(conn, table, ids) for table, ids in drop.items()}
+    bump_data_version(conn, "transactions")
+    now = datetime.now(timezone.utc).isoformat()
+    conn.executemany(
+        "INSERT INTO duplicate_log(resolved_at, shopify_id, qbo_id, action, sku, shopify_sku, qbo_sku, quantity, total, shopify_desc, qbo_desc, created_at, shopify_created_at, qbo_created_at, deleted_hash, ignored) "
+        "VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,0)",
+        [
             (
-                datetime.now(timezone.utc).isoformat(),
+                now,
                 p["shopify_id"],
                 p["qbo_id"],
                 action,
@@ -414,58 +1140,70 @@ def _resolve_duplicates(conn, action):
                 p["shopify_desc"],
                 p["qbo_desc"],
                 p["created_at"],
-                p["shopify_created_at"],
-                p["qbo_created_at"],
-            ),
+                p.get("shopify_created_raw") or p["shopify_created_at"],
+                p.get("qbo_created_raw") or p["qbo_created_at"],
+                (
+                    hashes[_DISCARDED[action]].get(p[f"{_DISCARDED[action]}_id"])
+                    if action in _DISCARDED
+                    else None
+                ),
+            )
+            for p, action in resolutions
+        ],
+    )
+    deleted = {}
+    for table, ids in drop.items():
+        _adjust_rollup(conn, table, ids, -1)
+        deleted[table] = _delete_transactions(conn, table, ids)
+    return deleted
+
+
+def _line_hashes(conn, table, ids):
+    """Return ``{rowid: line_hash}`` for the given ``table`` rows."""
+    if not ids:
+        return {}
+    ensure_line_hashes(conn, table)
+    hashes = {}
+    for batch in _id_batches(ids):
+        hashes.update(
+            conn.execute(
+                f"SELECT rowid, line_hash FROM {table} "
+                f"WHERE rowid IN ({','.join('?' * len(batch))})",
+                batch,
+            ).fetchall()
         )
-        if action == "shopify":
-            conn.execute("DELETE FROM qbo WHERE rowid=?", (p["qbo_id"],))
-        elif action == "qbo":
-            conn.execute("DELETE FROM shopify WHERE rowid=?", (p["shopify_id"],))
-        elif action == "both":
-            continue
+    return hashes
 
 
-def _resolve_duplicate_pair(conn, sid, qid, action):
-    """Resolve a specific duplicate pair."""
-    pairs = _find_duplicates(conn)
-    pair = next(
-        (p for p in pairs if p["shopify_id"] == sid and p["qbo_id"] == qid), None
-    )
-    if not pair:
-        return
-    conn.execute(
-        "UPDATE duplicate_log SET ignored=0 WHERE shopify_id=? AND qbo_id=?", (sid, qid)
-    )
-    conn.execute(
-        "INSERT INTO duplicate_log(resolved_at, shopify_id, qbo_id, action, sku, shopify_sku, qbo_sku, quantity, total, shopify_desc, qbo_desc, created_at, shopify_created_at, qbo_created_at, ignored) "
-        "VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,0)",
-        (
-            datetime.now(timezone.utc).isoformat(),
-            sid,
-            qid,
-            action,
-            pair["sku"],
-            pair.get("shopify_sku"),
-            pair.get("qbo_sku"),
-            pair["quantity"],
-            pair["total"],
-            pair["shopify_desc"],
-            pair["qbo_desc"],
-            pair["created_at"],
-            pair["shopify_created_at"],
-            pair["qbo_created_at"],
-        ),
-    )
-    if action == "shopify":
-        conn.execute("DELETE FROM qbo WHERE rowid=?", (qid,))
-    elif action == "qbo":
-        conn.execute("DELETE FROM shopify WHERE rowid=?", (sid,))
+def _delete_transactions(conn, table, ids):
+    """Delete ``table`` rows by rowid along with their duplicate candidates.
+
+    Rows are deleted ``SQL_IN_BATCH`` ids at a time. Returns the number of
+    transaction rows deleted.
+    """
+    deleted = 0
+    for batch in _id_batches(ids):
+        placeholders = ",".join("?" * len(batch))
+        cur = conn.execute(
+            f"DELETE FROM {table} WHERE rowid IN ({placeholders})", batch
+        )
+        deleted += cur.rowcount
+        conn.execute(
+            "DELETE FROM duplicate_candidates "
+            f"WHERE source=? AND row_id IN ({placeholders})",
+            [table, *batch],
+        )
+    return deleted
 
 
-def _find_duplicates(conn, sku=None, start=None, end=None):
+def _find_duplicates(conn, sku=None, start=None, end=None, pair=None):
     """Return possible duplicate transactions between Shopify and QBO.
 
+    Rows are matched through ``duplicate_candidates`` on their day, quantity,
+    total and canonical SKU. SKUs are resolved against ``sku_map`` here rather
+    than when rows are indexed, so editing the map never invalidates the
+    index.
+
     Parameters
     ----------
     conn : sqlite3.Connection
@@ -476,72 +1214,52 @@ def _find_duplicates(conn, sku=None, start=None, end=None):
         Include transactions on or after this date.
     end : datetime, optional
         Include transactions on or before this date.
+    pair : tuple, optional
+        ``(shopify_id, qbo_id)`` of the only pair to return.
     """
-    shopify = pd.read_sql_query(
-        "SELECT rowid AS id, created_at, sku, description, quantity, total FROM shopify",
-        conn,
-    )
-    qbo = pd.read_sql_query(
-        "SELECT rowid AS id, created_at, sku, description, quantity, total FROM qbo",
-        conn,
-    )
-    mapping = pd.read_sql_query("SELECT alias, canonical_sku FROM sku_map", conn)
-
-    alias_map = mapping.copy()
-    alias_map["alias"] = alias_map["alias"].str.lower()
-    alias_map = alias_map.set_index("alias")["canonical_sku"]
-
-    def canonical(alias):
-        if isinstance(alias, str):
-            key = alias.lower().strip()
-            if key in alias_map.index:
-                return alias_map.loc[key]
-            return key
-        return alias
-
-    for df in (shopify, qbo):
-        df["canonical"] = df["sku"].apply(canonical)
-        df["quantity"] = pd.to_numeric(df["quantity"], errors="coerce").astype(float)
-        df["total"] = pd.to_numeric(df["total"], errors="coerce").astype(float)
-        df["created_at"] = pd.to_datetime(
-            df["created_at"].astype(str), errors="coerce", format="mixed", utc=True
-        ).dt.tz_localize(None)
-        df["date"] = df["created_at"].dt.date
-
-    shopify = shopify.dropna(subset=["created_at"])
-    qbo = qbo.dropna(subset=["created_at"])
-
-    if start is not None:
-        shopify = shopify[shopify["created_at"] >= start]
-        qbo = qbo[qbo["created_at"] >= start]
-    if end is not None:
-        shopify = shopify[shopify["created_at"] <= end]
-        qbo = qbo[qbo["created_at"] <= end]
+    s_where, s_params = _created_range(start, end, "sf.created_ts")
+    q_where, q_params = _created_range(start, end, "qf.created_ts")
+    clauses = ["s.source='shopify'", s_where, q_where]
+    params = s_params + q_params
+    if pair is not None:
+        clauses.append("s.row_id=? AND q.row_id=?")
+        params.extend(int(i) for i in pair)
     if sku:
-        shopify = shopify[shopify["canonical"] == sku]
-        qbo = qbo[qbo["canonical"] == sku]
-
-    merged = pd.merge(
-        shopify,
-        qbo,
-        on=["date", "canonical", "quantity", "total"],
-        suffixes=("_s", "_q"),
-    )
-
-    ignored_df = pd.read_sql_query(
-        "SELECT shopify_id, qbo_id FROM duplicate_log WHERE ignored=1", conn
-    )
-    ignored_pairs = (
-        set(map(tuple, ignored_df.values)) if not ignored_df.empty else set()
-    )
+        clauses.append(f"{_CANONICAL.format(c='s', m='ms')}=?")
+        params.append(sku)
 
-    unmatched_df = pd.read_sql_query(
-        "SELECT shopify_id, qbo_id FROM duplicate_log WHERE action='unmatched'",
-        conn,
-    )
-    unmatched_pairs = (
-        set(map(tuple, unmatched_df.values)) if not unmatched_df.empty else set()
-    )
+    query = f"""
+        SELECT s.row_id AS id_s, q.row_id AS id_q,
+               {_CANONICAL.format(c='s', m='ms')} AS canonical,
+               s.quantity, s.total,
+               sf.created_ts AS created_ts_s, qf.created_ts AS created_ts_q,
+               sf.created_at AS raw_created_s, qf.created_at AS raw_created_q,
+               sf.sku AS sku_s, qf.sku AS sku_q,
+               sf.description AS description_s, qf.description AS description_q,
+               EXISTS(
+                   SELECT 1 FROM duplicate_log
+                   WHERE shopify_id=s.row_id AND qbo_id=q.row_id AND +ignored=1
+               ) AS ignored,
+               EXISTS(
+                   SELECT 1 FROM duplicate_log
+                   WHERE shopify_id=s.row_id AND qbo_id=q.row_id
+                     AND +action='unmatched'
+               ) AS unmatched
+        FROM duplicate_candidates s
+        JOIN duplicate_candidates q
+          ON q.source='qbo' AND q.day=s.day
+         AND q.quantity IS s.quantity AND q.total IS s.total
+        JOIN shopify sf ON sf.rowid=s.row_id
+        JOIN qbo qf ON qf.rowid=q.row_id
+        LEFT JOIN sku_map ms ON ms.alias=s.sku_key
+        LEFT JOIN sku_map mq ON mq.alias=q.sku_key
+        WHERE {" AND ".join(clauses)}
+          AND {_CANONICAL.format(c='q', m='mq')} IS {_CANONICAL.format(c='s', m='ms')}
+        ORDER BY s.row_id, q.row_id
+    """
+    merged = pd.read_sql_query(query, conn, params=params)
+    merged["created_at_s"] = created_datetime(merged["created_ts_s"])
+    merged["created_at_q"] = created_datetime(merged["created_ts_q"])
 
     rows = []
     for r in merged.itertuples(index=False):
@@ -555,6 +1273,8 @@ def _find_duplicates(conn, sku=None, start=None, end=None):
                     sep=" ", timespec="seconds"
                 ),
                 "qbo_created_at": r.created_at_q.isoformat(sep=" ", timespec="seconds"),
+                "shopify_created_raw": r.raw_created_s,
+                "qbo_created_raw": r.raw_created_q,
                 "sku": r.canonical,
                 "shopify_sku": r.sku_s,
                 "qbo_sku": r.sku_q,
@@ -562,8 +1282,8 @@ def _find_duplicates(conn, sku=None, start=None, end=None):
                 "qbo_desc": r.description_q,
                 "quantity": r.quantity,
                 "total": r.total,
-                "unmatched": (r.id_s, r.id_q) in unmatched_pairs,
-                "ignored": (r.id_s, r.id_q) in ignored_pairs,
+                "unmatched": bool(r.unmatched),
+                "ignored": bool(r.ignored),
             }
         )
     return rows
@@ -631,6 +1351,8 @@ def sku_map_page():
                     "UPDATE sku_map SET type=?, changed_at=? WHERE canonical_sku=?",
                     (target_type, datetime.now(timezone.utc).isoformat(), target),
                 )
+                _rebuild_rollup(conn)
+                bump_data_version(conn)
                 conn.commit()
                 flash("Entries merged.")
         else:
@@ -680,6 +1402,8 @@ def sku_map_page():
                             datetime.now(timezone.utc).isoformat(),
                         ),
                     )
+            _rebuild_rollup(conn)
+            bump_data_version(conn)
             conn.commit()
             flash("SKU map updated.")
         conn.close()
@@ -689,32 +1413,15 @@ def sku_map_page():
         "SELECT alias, canonical_sku, type, source, changed_at FROM sku_map",
         conn,
     )
-    shopify = pd.read_sql_query("SELECT created_at, sku FROM shopify", conn)
-    qbo = pd.read_sql_query("SELECT created_at, sku FROM qbo", conn)
+    shopify = pd.read_sql_query("SELECT created_ts, sku FROM shopify", conn)
+    qbo = pd.read_sql_query("SELECT created_ts, sku FROM qbo", conn)
     conn.close()
 
     all_txn = _safe_concat([shopify, qbo], ignore_index=True)
-    all_txn["created_at"] = pd.to_datetime(
-        all_txn["created_at"].astype(str),
-        errors="coerce",
-        format="mixed",
-        utc=True,
-    ).dt.tz_localize(None)
+    all_txn["created_at"] = created_datetime(all_txn["created_ts"])
     all_txn = all_txn.dropna(subset=["created_at"])
 
-    alias_map = mapping_df.copy()
-    alias_map["alias"] = alias_map["alias"].str.lower()
-    alias_map = alias_map.set_index("alias")["canonical_sku"]
-
-    def canonical(alias):
-        if isinstance(alias, str):
-            key = alias.lower().strip()
-            if key in alias_map.index:
-                return alias_map.loc[key]
-            return key
-        return alias
-
-    all_txn["canonical"] = all_txn["sku"].apply(canonical)
+    all_txn["canonical"] = _resolve_skus(all_txn["sku"], mapping_df)[0]
     last_dates = all_txn.groupby("canonical")["created_at"].max().to_dict()
     changed_dates = pd.to_datetime(
         mapping_df["changed_at"], errors="coerce", utc=True
@@ -797,6 +1504,39 @@ def export_sku_map():
     )
 
 
+def _import_sku_map(conn, df, merge=False):
+    """Write the rows of an uploaded SKU map ``df`` to ``sku_map``.
+
+    Columns are normalized with vectorized string operations and written with
+    a single ``executemany``. The existing map is replaced unless ``merge`` is
+    set, in which case imported aliases overwrite matching rows and all other
+    rows are kept. Returns the number of rows written.
+    """
+
+    def _clean(col):
+        return df[col].astype(str).str.lower().str.strip()
+
+    alias = _clean("alias")
+    canonical = _clean("canonical_sku")
+    type_val = _clean("type")
+    rows = pd.DataFrame(
+        {
+            "alias": alias,
+            "canonical_sku": canonical.where(canonical != "", alias),
+            "type": type_val.where(type_val != "", "unmapped"),
+            "source": _clean("source") if "source" in df.columns else "",
+            "changed_at": datetime.now(timezone.utc).isoformat(),
+        }
+    )
+    if not merge:
+        conn.execute("DELETE FROM sku_map")
+    conn.executemany(
+        "REPLACE INTO sku_map(alias, canonical_sku, type, source, changed_at) VALUES(?,?,?,?,?)",
+        rows.itertuples(index=False, name=None),
+    )
+    return len(rows)
+
+
 @app.route("/import-sku-map", methods=["POST"])
 def import_sku_map():
     """Import SKU mapping from an uploaded CSV or Excel file."""
@@ -805,36 +1545,14 @@ def import_sku_map():
         flash("No SKU map file provided.")
         return redirect(url_for("settings_page"))
     try:
-        if file.filename.lower().endswith((".xls", ".xlsx")):
-            df = pd.read_excel(file)
-        else:
-            df = pd.read_csv(file)
-    except Exception:
-        flash("Unable to parse SKU map file.")
-        return redirect(url_for("settings_page"))
-    required = {"alias", "canonical_sku", "type"}
-    if not required.issubset(df.columns):
-        flash("SKU map file must contain alias, canonical_sku and type columns.")
+        df = _read_sku_map(file, file.filename)
+    except ValueError as exc:
+        flash(str(exc))
         return redirect(url_for("settings_page"))
-    if "source" not in df.columns:
-        df["source"] = ""
     conn = get_db()
-    conn.execute("DELETE FROM sku_map")
-    for row in df[["alias", "canonical_sku", "type", "source"]].itertuples(index=False):
-        alias = str(row.alias).lower().strip()
-        canonical = str(row.canonical_sku).lower().strip() or alias
-        type_val = str(row.type).lower().strip() or "unmapped"
-        source_val = str(row.source).lower().strip() if hasattr(row, "source") else ""
-        conn.execute(
-            "INSERT INTO sku_map(alias, canonical_sku, type, source, changed_at) VALUES(?,?,?,?,?)",
-            (
-                alias,
-                canonical,
-                type_val,
-                source_val,
-                datetime.now(timezone.utc).isoformat(),
-            ),
-        )
+    _import_sku_map(conn, df, merge=bool(request.form.get("merge")))
+    _rebuild_rollup(conn)
+    bump_data_version(conn)
     conn.commit()
     conn.close()
     flash("SKU map imported.")
@@ -846,6 +1564,8 @@ def clear_skus():
     """Delete all SKU mappings."""
     conn = get_db()
     conn.execute("DELETE FROM sku_map")
+    _rebuild_rollup(conn)
+    bump_data_version(conn)
     conn.commit()
     conn.close()
     return jsonify(success=True)
@@ -881,6 +1601,8 @@ def update_parent():
         )
     if old_parent != new_parent:
         conn.execute("DELETE FROM sku_map WHERE canonical_sku=?", (old_parent,))
+    _rebuild_rollup(conn)
+    bump_data_version(conn)
     conn.commit()
     conn.close()
     return jsonify({"status": "ok"})
@@ -899,444 +1621,556 @@ def update_type():
         "UPDATE sku_map SET type=?, changed_at=? WHERE canonical_sku=?",
         (new_type, datetime.now(timezone.utc).isoformat(), canonical),
     )
+    _rebuild_rollup(conn)
+    bump_data_version(conn)
     conn.commit()
     conn.close()
     return jsonify({"status": "ok"})
 
 
-def calculate_report_data(year, month_param=None):
-    conn = get_db()
-    shopify = pd.read_sql_query(
-        "SELECT created_at, sku, quantity, total FROM shopify", conn
-    )
-    qbo = pd.read_sql_query("SELECT created_at, sku, quantity, total FROM qbo", conn)
-    mapping = pd.read_sql_query("SELECT alias, canonical_sku, type FROM sku_map", conn)
-    conn.close()
-
-    all_data = _safe_concat([shopify, qbo], ignore_index=True)
+def report_context(year, month_param=None):
+    """Return the shared ``ReportContext`` for ``year``.
 
-    # ensure numeric totals for reliable aggregation
-    all_data["total"] = pd.to_numeric(all_data["total"], errors="coerce").fillna(0)
-    all_data["quantity"] = pd.to_numeric(all_data["quantity"], errors="coerce").fillna(
-        0
-    )
+    Contexts are cached on the data version so any write to the transaction,
+    SKU map or duplicate tables invalidates them. The current month is part
+    of the key because month cutoffs depend on today's date. Sections
+    computed by one request are reused by the next.
+    """
+    now = datetime.now()
+    backend = _report_backend()
+    key = (year, month_param, backend, get_data_version(), now.year, now.month)
+    ctx = REPORT_CACHE.get(key)
+    if ctx is None:
+        ctx = ReportContext(year, month_param, backend)
+        REPORT_CACHE.set(key, ctx)
+    return ctx
 
-    all_data["created_at"] = pd.to_datetime(
-        all_data["created_at"].astype(str),
-        errors="coerce",
-        format="mixed",
-        utc=True,
-    ).dt.tz_localize(None)
-    all_data = all_data.dropna(subset=["created_at"])
 
-    alias_map = mapping.set_index("alias")
+def calculate_report_data(year, month_param=None):
+    """Return the report sections for ``year`` as a read-only mapping.
 
-    def map_row(alias, field):
-        if isinstance(alias, str):
-            key = alias.lower().strip()
-            if key in alias_map.index:
-                return alias_map.loc[key, field]
-            return key if field == "canonical_sku" else "unmapped"
-        return alias if field == "canonical_sku" else "unmapped"
+    Sections are computed as their keys are read; callers that need to
+    modify values should copy them, as they are shared with the cached
+    context.
+    """
+    return report_context(year, month_param)
 
-    all_data["canonical"] = all_data["sku"].apply(lambda x: map_row(x, "canonical_sku"))
-    all_data["type"] = all_data["sku"].apply(lambda x: map_row(x, "type"))
-    all_data["year"] = all_data["created_at"].dt.year
-    all_data["month"] = all_data["created_at"].dt.strftime("%b")
-    all_data["month_num"] = all_data["created_at"].dt.month
 
-    summary = (
-        all_data.groupby(["year", "month", "month_num"])
-        .agg({"total": "sum", "quantity": "sum"})
-        .reset_index()
-    )
-    cutoff_month = datetime.now().month if year == datetime.now().year else 12
+class ReportContext(Mapping):
+    """Report data for one year, computed one section at a time.
 
-    this_year = summary[summary["year"] == year].set_index("month")
-    last_year = summary[summary["year"] == year - 1].set_index("month")
+    Keys match the dict returned by ``calculate_report_data``. Period fields
+    (selected year and month, month choices and the last full month) are set
+    up front without touching the database. Every other key belongs to one of
+    ``SECTIONS`` and is computed the first time any key of that section is
+    read. Sections share the summary frames they load, so each frame is read
+    at most once per context.
+    """
 
-    months_list = [{"num": i, "name": m} for i, m in enumerate(MONTHS_ORDER, start=1)]
-    month_choices = months_list[:cutoff_month]
-    rows = []
-    for i, month in enumerate(MONTHS_ORDER[:cutoff_month], start=1):
-        current = this_year["total"].get(month, 0)
-        previous = last_year["total"].get(month, 0)
-        pct = "-"
-        if previous > 0:
-            pct = f"{((current - previous) / previous) * 100:.1f}%"
-        elif current > 0:
-            pct = "∞"
-        pct_sign = current - previous
-        rows.append((month, current, previous, pct, pct_sign))
-
-    # aggregate sales by quarter for the overall report
-    quarter_rows = []
-    for q, months in QUARTER_MAP.items():
-        months_in_range = [m for m in months if m <= cutoff_month]
-        if not months_in_range:
-            continue
-        cur_total = summary[
-            (summary["year"] == year) & summary["month_num"].isin(months_in_range)
-        ]["total"].sum()
-        prev_total = summary[
-            (summary["year"] == year - 1) & summary["month_num"].isin(months_in_range)
-        ]["total"].sum()
-        pct = "-"
-        if prev_total > 0:
-            pct = f"{((cur_total - prev_total) / prev_total) * 100:.1f}%"
-        elif cur_total > 0:
-            pct = "∞"
-        pct_sign = cur_total - prev_total
-        quarter_rows.append((f"Q{q}", cur_total, prev_total, pct, pct_sign))
+    SECTIONS = {
+        "overall": ("rows", "quarter_rows", "years"),
+        "types": ("type_rows",),
+        "last_month": ("last_rows",),
+        "sku_details": ("sku_details", "has_month_details"),
+        "shopify": (
+            "shopify_years",
+            "shopify_rows",
+            "shopify_totals",
+            "shopify_avg_total",
+            "shopify_quarters",
+        ),
+    }
+    _SECTION_OF = {key: name for name, keys in SECTIONS.items() for key in keys}
 
-    categories = CATEGORIES
-    labels = CATEGORY_LABELS
+    def __init__(self, year, month_param=None, backend=None):
+        self.year = year
+        self.backend = backend or _report_backend()
+        self._frames = {}
+        self._lock = threading.RLock()
 
-    # Shopify-only monthly totals across all years
-    shopify_only = shopify.copy()
-    shopify_only["total"] = pd.to_numeric(
-        shopify_only["total"], errors="coerce"
-    ).fillna(0)
-    shopify_only["created_at"] = pd.to_datetime(
-        shopify_only["created_at"].astype(str),
-        errors="coerce",
-        format="mixed",
-        utc=True,
-    ).dt.tz_localize(None)
-    shopify_only = shopify_only.dropna(subset=["created_at"])
-    shopify_only["year"] = shopify_only["created_at"].dt.year
-    shopify_only["month_num"] = shopify_only["created_at"].dt.month
+        # last full month shown in the detail sections
+        now = datetime.now()
+        if month_param:
+            last_month_year = year
+            last_month_num = month_param
+        else:
+            if year == now.year:
+                if now.month == 1:
+                    last_month_year = year - 1
+                    last_month_num = 12
+                else:
+                    last_month_year = year
+                    last_month_num = now.month - 1
+            else:
+                last_month_year = year
+                last_month_num = 12
+        self.last_month_year = last_month_year
+        self.last_month_num = last_month_num
+        self.cutoff_month = now.month if year == now.year else 12
 
-    shopify_summary = (
-        shopify_only.groupby(["year", "month_num"])["total"].sum().reset_index()
-    )
-    shopify_years = sorted(shopify_summary["year"].unique(), reverse=True)
-    shopify_pivot = (
-        shopify_summary.pivot(index="month_num", columns="year", values="total")
-        .reindex(range(1, 13))
-        .fillna(0)
-    )
-    shopify_avg = shopify_pivot.replace(0, math.nan).mean(axis=1)
-    now = datetime.now()
-    current_year = now.year
-    current_month = now.month
-    shopify_rows = []
-    for m in range(1, 13):
-        month_name = MONTHS_ORDER[m - 1]
-        raw_vals = [
-            float(shopify_pivot.at[m, y]) if y in shopify_pivot.columns else 0.0
-            for y in shopify_years
+        months_list = [
+            {"num": i, "name": m} for i, m in enumerate(MONTHS_ORDER, start=1)
         ]
-        avg_val = shopify_avg.get(m)
-        avg_val = 0.0 if pd.isna(avg_val) else float(avg_val)
-        values = []
-        for i, y in enumerate(shopify_years):
-            val = raw_vals[i]
-            if y == current_year and m > current_month:
-                values.append({"val": None, "diff": None})
-            else:
-                values.append({"val": val, "diff": val - avg_val})
-        shopify_rows.append({"month": month_name, "values": values, "avg": avg_val})
+        last_days = monthrange(last_month_year, last_month_num)[1]
+        self._base = {
+            "selected_year": year,
+            "selected_month": last_month_num,
+            "months": months_list[: self.cutoff_month],
+            "labels": CATEGORY_LABELS,
+            "last_month_label": datetime(
+                last_month_year, last_month_num, 1
+            ).strftime("%b"),
+            "last_month_year": last_month_year,
+            "last_month_num": last_month_num,
+            "last_start": f"{last_month_year}-{last_month_num:02d}-01",
+            "last_end": f"{last_month_year}-{last_month_num:02d}-{last_days:02d}",
+        }
+        self._values = dict(self._base)
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            section = self._SECTION_OF.get(key)
+            if section is None:
+                raise KeyError(key)
+            with self._lock:
+                if key not in self._values:
+                    self._values.update(getattr(self, f"_{section}")())
+        return self._values[key]
+
+    def __iter__(self):
+        yield from self._base
+        for keys in self.SECTIONS.values():
+            yield from keys
+
+    def __len__(self):
+        return len(self._base) + len(self._SECTION_OF)
+
+    def sections(self, *names):
+        """Return the period fields plus the keys of the named sections."""
+        data = dict(self._base)
+        for name in names:
+            for key in self.SECTIONS[name]:
+                data[key] = self[key]
+        return data
+
+    def as_dict(self):
+        """Return every section, computing any that are still missing."""
+        return dict(self)
+
+    def _frame(self, name):
+        """Return a summary frame, loading it on first use.
+
+        Month and type totals span every year for averages and the Shopify
+        pivots, but are aggregated by the backend. Per-SKU rows are only read
+        for the compared years plus the same month in earlier years.
+        """
+        with self._lock:
+            if name in self._frames:
+                return self._frames[name]
+            conn = get_db()
+            try:
+                if name == "summary":
+                    frame = _load_summary(
+                        conn, self.backend, group_by=["year", "month_num"]
+                    )
+                elif name == "summary_type":
+                    frame = _load_summary(
+                        conn, self.backend, group_by=["year", "month_num", "type"]
+                    )
+                elif name == "shopify_summary":
+                    frame = _load_summary(
+                        conn,
+                        self.backend,
+                        source="shopify",
+                        group_by=["year", "month_num"],
+                    )
+                else:
+                    year, last_year = self.year, self.last_month_year
+                    sku_years = {year, year - 1, last_year, last_year - 1}
+                    sku_keys = ["year", "month_num", "canonical", "type"]
+                    frame = _safe_concat(
+                        [
+                            _load_summary(
+                                conn, self.backend, years=sku_years, group_by=sku_keys
+                            ),
+                            _load_summary(
+                                conn,
+                                self.backend,
+                                month=self.last_month_num,
+                                before=min(sku_years),
+                                group_by=sku_keys,
+                            ),
+                        ],
+                        ignore_index=True,
+                    )
+            finally:
+                conn.close()
+            self._frames[name] = frame
+            return frame
+
+    def _overall(self):
+        year = self.year
+        cutoff_month = self.cutoff_month
+        summary = self._frame("summary")
+        this_year = summary[summary["year"] == year].set_index("month")
+        last_year = summary[summary["year"] == year - 1].set_index("month")
 
-    raw_totals = [
-        float(shopify_pivot[y].sum()) if y in shopify_pivot.columns else 0.0
-        for y in shopify_years
-    ]
-    nonzero_totals = [t for t in raw_totals if t != 0]
-    shopify_avg_total = (
-        float(sum(nonzero_totals) / len(nonzero_totals)) if nonzero_totals else 0.0
-    )
-    shopify_totals = []
-    for i, y in enumerate(shopify_years):
-        val = raw_totals[i]
-        diff = val - shopify_avg_total
-        if y == current_year and current_month < 12:
-            diff = None
-        shopify_totals.append({"val": val, "diff": diff})
-
-    # Shopify totals by quarter
-    shopify_quarters = []
-    for q, months in QUARTER_MAP.items():
-        vals = []
-        for y in shopify_years:
-            val = shopify_summary[
-                (shopify_summary["year"] == y)
-                & shopify_summary["month_num"].isin(months)
+        rows = []
+        for i, month in enumerate(MONTHS_ORDER[:cutoff_month], start=1):
+            current = this_year["total"].get(month, 0)
+            previous = last_year["total"].get(month, 0)
+            pct = "-"
+            if previous > 0:
+                pct = f"{((current - previous) / previous) * 100:.1f}%"
+            elif current > 0:
+                pct = "∞"
+            pct_sign = current - previous
+            rows.append((month, current, previous, pct, pct_sign))
+
+        # aggregate sales by quarter for the overall report
+        quarter_rows = []
+        for q, months in QUARTER_MAP.items():
+            months_in_range = [m for m in months if m <= cutoff_month]
+            if not months_in_range:
+                continue
+            cur_total = summary[
+                (summary["year"] == year) & summary["month_num"].isin(months_in_range)
             ]["total"].sum()
-            if y == current_year and max(months) > current_month:
-                vals.append(None)
-            else:
-                vals.append(float(val))
-        nonzero = [v for v in vals if v not in (None, 0)]
-        avg_val = sum(nonzero) / len(nonzero) if nonzero else 0.0
-        values = []
-        for i, y in enumerate(shopify_years):
-            v = vals[i]
-            if v is None:
-                values.append({"val": None, "diff": None})
-            else:
-                values.append({"val": v, "diff": v - avg_val})
-        shopify_quarters.append({"quarter": f"Q{q}", "values": values, "avg": avg_val})
-
-    # yearly summary by type
-    summary_type = (
-        all_data.groupby(["year", "month_num", "type"])
-        .agg({"total": "sum", "quantity": "sum"})
-        .reset_index()
-    )
-    type_rows = []
-    for cat in categories:
-        cur = summary_type[
-            (summary_type["year"] == year) & (summary_type["type"] == cat)
-        ]
-        prev = summary_type[
-            (summary_type["year"] == year - 1)
-            & (summary_type["type"] == cat)
-            & (summary_type["month_num"] <= cutoff_month)
-        ]
-        totals = cur.set_index("month_num").reindex(
-            range(1, cutoff_month + 1), fill_value=0
-        )
-        totals = totals["total"]
-        total_cur = totals.sum()
-        total_prev = prev["total"].sum()
-        vs_last = "-"
-        if total_prev > 0:
-            vs_last = f"{((total_cur - total_prev) / total_prev) * 100:.1f}%"
-        elif total_cur > 0:
-            vs_last = "∞"
-        vs_last_sign = total_cur - total_prev
-        overall_cat = summary_type[summary_type["type"] == cat]
-        avg_month = overall_cat["total"].mean() if len(overall_cat) else 0
-        best_month = overall_cat["total"].max() if len(overall_cat) else 0
-        avg_qty = overall_cat["quantity"].mean() if len(overall_cat) else 0
-        best_qty = overall_cat["quantity"].max() if len(overall_cat) else 0
-        type_rows.append(
-            {
-                "type": labels.get(cat, cat),
-                "total": total_cur,
-                "vs_last": vs_last,
-                "vs_last_sign": vs_last_sign,
-                "avg_month": avg_month,
-                "best_month": best_month,
-                "avg_qty": avg_qty,
-                "best_qty": best_qty,
-            }
+            prev_total = summary[
+                (summary["year"] == year - 1)
+                & summary["month_num"].isin(months_in_range)
+            ]["total"].sum()
+            pct = "-"
+            if prev_total > 0:
+                pct = f"{((cur_total - prev_total) / prev_total) * 100:.1f}%"
+            elif cur_total > 0:
+                pct = "∞"
+            pct_sign = cur_total - prev_total
+            quarter_rows.append((f"Q{q}", cur_total, prev_total, pct, pct_sign))
+
+        years = sorted(set(summary["year"].unique()).union({year}), reverse=True)
+        return {"rows": rows, "quarter_rows": quarter_rows, "years": years}
+
+    def _shopify(self):
+        # Shopify-only monthly totals across all years
+        shopify_summary = self._frame("shopify_summary")
+        shopify_years = sorted(shopify_summary["year"].unique(), reverse=True)
+        shopify_pivot = (
+            shopify_summary.pivot(index="month_num", columns="year", values="total")
+            .reindex(range(1, 13))
+            .fillna(0)
         )
+        shopify_avg = shopify_pivot.replace(0, math.nan).mean(axis=1)
+        now = datetime.now()
+        current_year = now.year
+        current_month = now.month
+        shopify_rows = []
+        for m in range(1, 13):
+            month_name = MONTHS_ORDER[m - 1]
+            raw_vals = [
+                float(shopify_pivot.at[m, y]) if y in shopify_pivot.columns else 0.0
+                for y in shopify_years
+            ]
+            avg_val = shopify_avg.get(m)
+            avg_val = 0.0 if pd.isna(avg_val) else float(avg_val)
+            values = []
+            for i, y in enumerate(shopify_years):
+                val = raw_vals[i]
+                if y == current_year and m > current_month:
+                    values.append({"val": None, "diff": None})
+                else:
+                    values.append({"val": val, "diff": val - avg_val})
+            shopify_rows.append({"month": month_name, "values": values, "avg": avg_val})
 
-    # last full month summary by type
-    now = datetime.now()
-    if month_param:
-        last_month_year = year
-        last_month_num = month_param
-    else:
-        if year == now.year:
-            if now.month == 1:
-                last_month_year = year - 1
-                last_month_num = 12
-            else:
-                last_month_year = year
-                last_month_num = now.month - 1
-        else:
-            last_month_year = year
-            last_month_num = 12
+        raw_totals = [
+            float(shopify_pivot[y].sum()) if y in shopify_pivot.columns else 0.0
+            for y in shopify_years
+        ]
+        nonzero_totals = [t for t in raw_totals if t != 0]
+        shopify_avg_total = (
+            float(sum(nonzero_totals) / len(nonzero_totals)) if nonzero_totals else 0.0
+        )
+        shopify_totals = []
+        for i, y in enumerate(shopify_years):
+            val = raw_totals[i]
+            diff = val - shopify_avg_total
+            if y == current_year and current_month < 12:
+                diff = None
+            shopify_totals.append({"val": val, "diff": diff})
+
+        # Shopify totals by quarter
+        shopify_quarters = []
+        for q, months in QUARTER_MAP.items():
+            vals = []
+            for y in shopify_years:
+                val = shopify_summary[
+                    (shopify_summary["year"] == y)
+                    & shopify_summary["month_num"].isin(months)
+                ]["total"].sum()
+                if y == current_year and max(months) > current_month:
+                    vals.append(None)
+                else:
+                    vals.append(float(val))
+            nonzero = [v for v in vals if v not in (None, 0)]
+            avg_val = sum(nonzero) / len(nonzero) if nonzero else 0.0
+            values = []
+            for i, y in enumerate(shopify_years):
+                v = vals[i]
+                if v is None:
+                    values.append({"val": None, "diff": None})
+                else:
+                    values.append({"val": v, "diff": v - avg_val})
+            shopify_quarters.append(
+                {"quarter": f"Q{q}", "values": values, "avg": avg_val}
+            )
 
-    last_month_label = datetime(last_month_year, last_month_num, 1).strftime("%b")
-    last_start = f"{last_month_year}-{last_month_num:02d}-01"
-    last_end = f"{last_month_year}-{last_month_num:02d}-{monthrange(last_month_year, last_month_num)[1]:02d}"
+        return {
+            "shopify_years": shopify_years,
+            "shopify_rows": shopify_rows,
+            "shopify_totals": shopify_totals,
+            "shopify_avg_total": shopify_avg_total,
+            "shopify_quarters": shopify_quarters,
+        }
+
+    def _types(self):
+        # yearly summary by type
+        year = self.year
+        cutoff_month = self.cutoff_month
+        summary_type = self._frame("summary_type")
+        type_rows = []
+        for cat in CATEGORIES:
+            cur = summary_type[
+                (summary_type["year"] == year) & (summary_type["type"] == cat)
+            ]
+            prev = summary_type[
+                (summary_type["year"] == year - 1)
+                & (summary_type["type"] == cat)
+                & (summary_type["month_num"] <= cutoff_month)
+            ]
+            totals = cur.set_index("month_num").reindex(
+                range(1, cutoff_month + 1), fill_value=0
+            )
+            totals = totals["total"]
+            total_cur = totals.sum()
+            total_prev = prev["total"].sum()
+            vs_last = "-"
+            if total_prev > 0:
+                vs_last = f"{((total_cur - total_prev) / total_prev) * 100:.1f}%"
+            elif total_cur > 0:
+                vs_last = "∞"
+            vs_last_sign = total_cur - total_prev
+            overall_cat = summary_type[summary_type["type"] == cat]
+            avg_month = overall_cat["total"].mean() if len(overall_cat) else 0
+            best_month = overall_cat["total"].max() if len(overall_cat) else 0
+            avg_qty = overall_cat["quantity"].mean() if len(overall_cat) else 0
+            best_qty = overall_cat["quantity"].max() if len(overall_cat) else 0
+            type_rows.append(
+                {
+                    "type": CATEGORY_LABELS.get(cat, cat),
+                    "total": total_cur,
+                    "vs_last": vs_last,
+                    "vs_last_sign": vs_last_sign,
+                    "avg_month": avg_month,
+                    "best_month": best_month,
+                    "avg_qty": avg_qty,
+                    "best_qty": best_qty,
+                }
+            )
+        return {"type_rows": type_rows}
+
+    def _last_month(self):
+        # last full month summary by type
+        last_month_year = self.last_month_year
+        last_month_num = self.last_month_num
+        summary_type = self._frame("summary_type")
+        last_rows = []
+        for cat in CATEGORIES:
+            cur_month = summary_type[
+                (summary_type["year"] == last_month_year)
+                & (summary_type["month_num"] == last_month_num)
+                & (summary_type["type"] == cat)
+            ]
+            prev_month = summary_type[
+                (summary_type["year"] == last_month_year - 1)
+                & (summary_type["month_num"] == last_month_num)
+                & (summary_type["type"] == cat)
+            ]
+            cur_total = cur_month["total"].sum()
+            prev_total = prev_month["total"].sum()
+            vs_last = "-"
+            if prev_total > 0:
+                vs_last = f"{((cur_total - prev_total) / prev_total) * 100:.1f}%"
+            elif cur_total > 0:
+                vs_last = "∞"
+            vs_last_sign = cur_total - prev_total
+            prev_same = summary_type[
+                (summary_type["type"] == cat)
+                & (summary_type["month_num"] == last_month_num)
+                & (summary_type["year"] < last_month_year)
+            ]
+            avg_month = prev_same["total"].mean() if len(prev_same) else 0
+            best_month = prev_same["total"].max() if len(prev_same) else 0
+            avg_month_sign = cur_total - avg_month
+            best_month_sign = cur_total - best_month
+            last_rows.append(
+                {
+                    "type": CATEGORY_LABELS.get(cat, cat),
+                    "total": cur_total,
+                    "vs_last": vs_last,
+                    "vs_last_sign": vs_last_sign,
+                    "avg_month": avg_month,
+                    "avg_month_sign": avg_month_sign,
+                    "best_month": best_month,
+                    "best_month_sign": best_month_sign,
+                }
+            )
 
-    last_rows = []
-    for cat in categories:
-        cur_month = summary_type[
+        # overall totals for the last full month
+        total_cur = summary_type[
             (summary_type["year"] == last_month_year)
             & (summary_type["month_num"] == last_month_num)
-            & (summary_type["type"] == cat)
-        ]
-        prev_month = summary_type[
+        ].agg({"total": "sum", "quantity": "sum"})
+        prev_total_cur = summary_type[
             (summary_type["year"] == last_month_year - 1)
             & (summary_type["month_num"] == last_month_num)
-            & (summary_type["type"] == cat)
-        ]
-        cur_total = cur_month["total"].sum()
-        prev_total = prev_month["total"].sum()
+        ]["total"].sum()
+        total_val = total_cur["total"]
         vs_last = "-"
-        if prev_total > 0:
-            vs_last = f"{((cur_total - prev_total) / prev_total) * 100:.1f}%"
-        elif cur_total > 0:
+        if prev_total_cur > 0:
+            vs_last = f"{((total_val - prev_total_cur) / prev_total_cur) * 100:.1f}%"
+        elif total_val > 0:
             vs_last = "∞"
-        vs_last_sign = cur_total - prev_total
-        prev_same = summary_type[
-            (summary_type["type"] == cat)
-            & (summary_type["month_num"] == last_month_num)
+        prev_months = summary_type[
+            (summary_type["month_num"] == last_month_num)
             & (summary_type["year"] < last_month_year)
         ]
-        avg_month = prev_same["total"].mean() if len(prev_same) else 0
-        best_month = prev_same["total"].max() if len(prev_same) else 0
-        avg_month_sign = cur_total - avg_month
-        best_month_sign = cur_total - best_month
+        avg_month = prev_months["total"].mean() if len(prev_months) else 0
+        best_month = prev_months["total"].max() if len(prev_months) else 0
         last_rows.append(
             {
-                "type": labels.get(cat, cat),
-                "total": cur_total,
+                "type": "Total",
+                "total": total_val,
                 "vs_last": vs_last,
-                "vs_last_sign": vs_last_sign,
+                "vs_last_sign": total_val - prev_total_cur,
                 "avg_month": avg_month,
-                "avg_month_sign": avg_month_sign,
+                "avg_month_sign": total_val - avg_month,
                 "best_month": best_month,
-                "best_month_sign": best_month_sign,
+                "best_month_sign": total_val - best_month,
             }
         )
-
-    # overall totals for the last full month
-    total_cur = summary_type[
-        (summary_type["year"] == last_month_year)
-        & (summary_type["month_num"] == last_month_num)
-    ].agg({"total": "sum", "quantity": "sum"})
-    prev_total_cur = summary_type[
-        (summary_type["year"] == last_month_year - 1)
-        & (summary_type["month_num"] == last_month_num)
-    ]["total"].sum()
-    total_val = total_cur["total"]
-    vs_last = "-"
-    if prev_total_cur > 0:
-        vs_last = f"{((total_val - prev_total_cur) / prev_total_cur) * 100:.1f}%"
-    elif total_val > 0:
-        vs_last = "∞"
-    prev_months = summary_type[
-        (summary_type["month_num"] == last_month_num)
-        & (summary_type["year"] < last_month_year)
-    ]
-    avg_month = prev_months["total"].mean() if len(prev_months) else 0
-    best_month = prev_months["total"].max() if len(prev_months) else 0
-    last_rows.append(
-        {
-            "type": "Total",
-            "total": total_val,
-            "vs_last": vs_last,
-            "vs_last_sign": total_val - prev_total_cur,
-            "avg_month": avg_month,
-            "avg_month_sign": total_val - avg_month,
-            "best_month": best_month,
-            "best_month_sign": total_val - best_month,
+        return {"last_rows": last_rows}
+
+    def _sku_details(self):
+        # detailed breakdown by SKU for the last full month
+        sku_details = _sku_detail_rows(
+            self._frame("summary_sku"),
+            self.year,
+            self.cutoff_month,
+            self.last_month_year,
+            self.last_month_num,
+            CATEGORIES,
+        )
+        return {
+            "sku_details": sku_details,
+            "has_month_details": any(len(v) > 0 for v in sku_details.values()),
         }
-    )
 
-    # detailed breakdown by SKU for the last full month
-    summary_sku = (
-        all_data.groupby(["year", "month_num", "canonical", "type"])
-        .agg({"total": "sum", "quantity": "sum"})
-        .reset_index()
-    )
 
-    sku_details = {}
-    for cat in categories:
-        cat_rows = []
-        cat_df = summary_sku[summary_sku["type"] == cat]
-        cat_year = cat_df[
-            (cat_df["year"] == year) & (cat_df["month_num"] <= cutoff_month)
-        ]
-        cat_last = cat_df[
-            (cat_df["year"] == last_month_year)
-            & (cat_df["month_num"] == last_month_num)
-        ]
-        cat_prev = cat_df[
-            (cat_df["year"] == last_month_year - 1)
-            & (cat_df["month_num"] == last_month_num)
-        ]
-        skus = cat_df["canonical"].unique()
-        for sku in sorted(skus):
-            cur_total_chk = cat_df[
-                (cat_df["canonical"] == sku) & (cat_df["year"] == year)
-            ]["total"].sum()
-            prev_total_chk = cat_df[
-                (cat_df["canonical"] == sku) & (cat_df["year"] == year - 1)
-            ]["total"].sum()
-            if cur_total_chk == 0 or prev_total_chk == 0:
-                continue
-            ydf = cat_year[cat_year["canonical"] == sku]
-            overall_sku = cat_df[cat_df["canonical"] == sku]
-            ldf = cat_last[cat_last["canonical"] == sku]
-            pdf = cat_prev[cat_prev["canonical"] == sku]
-            year_total = ydf["total"].sum()
-            year_qty = ydf["quantity"].sum()
-            month_total = ldf["total"].sum()
-            month_qty = ldf["quantity"].sum()
-            last_year_total = pdf["total"].sum()
-            last_year_sign = month_total - last_year_total
-            prev_sku = overall_sku[
-                (overall_sku["month_num"] == last_month_num)
-                & (overall_sku["year"] < last_month_year)
-            ]
-            avg_month = prev_sku["total"].mean() if len(prev_sku) else 0
-            avg_qty = prev_sku["quantity"].mean() if len(prev_sku) else 0
-            best_month = prev_sku["total"].max() if len(prev_sku) else 0
-            best_qty = prev_sku["quantity"].max() if len(prev_sku) else 0
-            avg_month_sign = month_total - avg_month
-            avg_qty_sign = month_qty - avg_qty
-            best_month_sign = month_total - best_month
-            best_qty_sign = month_qty - best_qty
-            cat_rows.append(
-                {
-                    "sku": sku,
-                    "year_total": year_total,
-                    "year_qty": year_qty,
-                    "month_total": month_total,
-                    "month_qty": month_qty,
-                    "avg_month": avg_month,
-                    "avg_month_sign": avg_month_sign,
-                    "avg_qty": avg_qty,
-                    "avg_qty_sign": avg_qty_sign,
-                    "last_year": last_year_total,
-                    "last_year_sign": last_year_sign,
-                    "best_month": best_month,
-                    "best_month_sign": best_month_sign,
-                    "best_qty": best_qty,
-                    "best_qty_sign": best_qty_sign,
-                }
-            )
-        sku_details[cat] = cat_rows
+def _sku_detail_rows(
+    summary_sku, year, cutoff_month, last_month_year, last_month_num, categories
+):
+    """Return per-category SKU rows for the last-month details section.
 
-    years = sorted(set(summary["year"].unique()).union({year}), reverse=True)
-    return {
-        "rows": rows,
-        "quarter_rows": quarter_rows,
-        "selected_year": year,
-        "selected_month": last_month_num,
-        "years": years,
-        "months": month_choices,
-        "labels": labels,
-        "type_rows": type_rows,
-        "last_month_label": last_month_label,
-        "last_rows": last_rows,
-        "sku_details": sku_details,
-        "has_month_details": any(len(v) > 0 for v in sku_details.values()),
-        "last_month_year": last_month_year,
-        "last_month_num": last_month_num,
-        "last_start": last_start,
-        "last_end": last_end,
-        "shopify_years": shopify_years,
-        "shopify_rows": shopify_rows,
-        "shopify_totals": shopify_totals,
-        "shopify_avg_total": shopify_avg_total,
-        "shopify_quarters": shopify_quarters,
-    }
+    ``summary_sku`` holds totals per (year, month_num, canonical, type). All
+    figures are computed with one grouped aggregation per measure keyed on
+    (type, canonical) instead of filtering the frame once per SKU. SKUs are
+    listed only when they sold in both ``year`` and the year before.
+    """
+    keys = ["type", "canonical"]
+    sums = ["total", "quantity"]
+    df = summary_sku[summary_sku["type"].isin(categories)]
+    in_year = df["year"] == year
+    last_month = df["month_num"] == last_month_num
+
+    cur_chk = df[in_year].groupby(keys)["total"].sum()
+    prev_chk = df[df["year"] == year - 1].groupby(keys)["total"].sum()
+    year_tot = df[in_year & (df["month_num"] <= cutoff_month)].groupby(keys)[sums].sum()
+    month_tot = df[(df["year"] == last_month_year) & last_month].groupby(keys)[sums].sum()
+    last_year = (
+        df[(df["year"] == last_month_year - 1) & last_month]
+        .groupby(keys)["total"]
+        .sum()
+    )
+    history = (
+        df[(df["year"] < last_month_year) & last_month]
+        .groupby(keys)
+        .agg(
+            avg_month=("total", "mean"),
+            avg_qty=("quantity", "mean"),
+            best_month=("total", "max"),
+            best_qty=("quantity", "max"),
+        )
+    )
+
+    eligible = cur_chk.index.intersection(prev_chk.index)
+    eligible = eligible[
+        (cur_chk.reindex(eligible) != 0).to_numpy()
+        & (prev_chk.reindex(eligible) != 0).to_numpy()
+    ]
+    details = pd.DataFrame(index=eligible)
+    details["year_total"] = year_tot["total"].reindex(eligible, fill_value=0)
+    details["year_qty"] = year_tot["quantity"].reindex(eligible, fill_value=0)
+    details["month_total"] = month_tot["total"].reindex(eligible, fill_value=0)
+    details["month_qty"] = month_tot["quantity"].reindex(eligible, fill_value=0)
+    details["last_year"] = last_year.reindex(eligible, fill_value=0)
+    for col in ("avg_month", "avg_qty", "best_month", "best_qty"):
+        details[col] = history[col].reindex(eligible, fill_value=0)
+    details["last_year_sign"] = details["month_total"] - details["last_year"]
+    details["avg_month_sign"] = details["month_total"] - details["avg_month"]
+    details["avg_qty_sign"] = details["month_qty"] - details["avg_qty"]
+    details["best_month_sign"] = details["month_total"] - details["best_month"]
+    details["best_qty_sign"] = details["month_qty"] - details["best_qty"]
+    details = details.sort_index()
+
+    columns = [
+        "year_total",
+        "year_qty",
+        "month_total",
+        "month_qty",
+        "avg_month",
+        "avg_month_sign",
+        "avg_qty",
+        "avg_qty_sign",
+        "last_year",
+        "last_year_sign",
+        "best_month",
+        "best_month_sign",
+        "best_qty",
+        "best_qty_sign",
+    ]
+    sku_details = {cat: [] for cat in categories}
+    for (cat, sku), values in zip(
+        details.index, details[columns].itertuples(index=False, name=None)
+    ):
+        row = {"sku": sku}
+        row.update(zip(columns, values))
+        sku_details[cat].append(row)
+    return sku_details
 
 
 def get_year_overall(year):
     """Return month-by-month totals for ``year``."""
-    data = calculate_report_data(year)
-    return data["rows"]
+    return report_context(year)["rows"]
 
 
 def get_year_summary(year):
     """Return yearly totals by type for ``year``."""
-    data = calculate_report_data(year)
-    return data["type_rows"]
+    return report_context(year)["type_rows"]
 
 
 def get_last_month_summary(year, month=None):
     """Return summary by type for the last full month."""
-    data = calculate_report_data(year, month)
+    data = report_context(year, month)
     return {
         "label": data["last_month_label"],
         "rows": data["last_rows"],
@@ -1345,7 +2179,7 @@ def get_last_month_summary(year, month=None):
 
 def get_last_month_details(year, month=None):
     """Return detailed SKU breakdown for the last full month."""
-    data = calculate_report_data(year, month)
+    data = report_context(year, month)
     return {
         "label": data["last_month_label"],
         "sku_details": data["sku_details"],
@@ -1354,7 +2188,7 @@ def get_last_month_details(year, month=None):
 
 def get_shopify_monthly():
     """Return Shopify monthly totals across years respecting the year limit."""
-    data = calculate_report_data(datetime.now().year)
+    data = report_context(datetime.now().year)
     year_limit = int(get_setting("reports_year_limit", "5") or 5)
     years = data["shopify_years"][:year_limit]
     rows = []
@@ -1383,7 +2217,7 @@ def get_shopify_monthly():
 
 def get_shopify_quarterly():
     """Return Shopify quarterly totals across years respecting the year limit."""
-    data = calculate_report_data(datetime.now().year)
+    data = report_context(datetime.now().year)
     year_limit = int(get_setting("reports_year_limit", "5") or 5)
     years = data["shopify_years"][:year_limit]
     rows = []
@@ -1405,9 +2239,72 @@ def get_shopify_quarterly():
 
 
 def get_traffic_matrix():
-    """Return HubSpot traffic metrics grouped for side-by-side years."""
-    conn = get_db()
+    """Return HubSpot traffic metrics grouped for side-by-side years.
+
+    The matrix is served from ``traffic_matrix_cache``, which the HubSpot
+    sync fills for each year window. A stale entry is returned as-is while a
+    background thread rebuilds it; a missing entry is built on the spot.
+    """
     year_limit = int(get_setting("reports_year_limit", "5") or 5)
+    conn = get_db()
+    version = get_data_version("hubspot", conn=conn)
+    row = conn.execute(
+        "SELECT version, data FROM traffic_matrix_cache WHERE year_limit=?",
+        (year_limit,),
+    ).fetchone()
+    if row is None:
+        data = _store_traffic_matrix(conn, year_limit)
+        conn.commit()
+        conn.close()
+        return data
+    conn.close()
+    if row["version"] != version:
+        _refresh_traffic_matrix_async(year_limit)
+    return json.loads(row["data"])
+
+
+def _store_traffic_matrix(conn, year_limit):
+    """Compute the traffic matrix for ``year_limit`` and cache it.
+
+    The version is read before the traffic rows so a sync that lands in
+    between leaves the entry marked stale. The caller commits.
+    """
+    version = get_data_version("hubspot", conn=conn)
+    data = _build_traffic_matrix(conn, year_limit)
+    conn.execute(
+        "REPLACE INTO traffic_matrix_cache(year_limit, version, built_at, data) "
+        "VALUES (?,?,?,?)",
+        (year_limit, version, datetime.now(timezone.utc).isoformat(), json.dumps(data)),
+    )
+    return data
+
+
+def _refresh_traffic_matrix(year_limit):
+    conn = get_db()
+    try:
+        _store_traffic_matrix(conn, year_limit)
+        conn.commit()
+    except Exception as exc:
+        log_error(f"Traffic matrix rebuild error: {exc}")
+    finally:
+        conn.close()
+        with _TRAFFIC_REFRESH_LOCK:
+            _TRAFFIC_REFRESHING.discard(year_limit)
+
+
+def _refresh_traffic_matrix_async(year_limit):
+    """Rebuild the cached matrix in a background thread unless one is running."""
+    with _TRAFFIC_REFRESH_LOCK:
+        if year_limit in _TRAFFIC_REFRESHING:
+            return
+        _TRAFFIC_REFRESHING.add(year_limit)
+    threading.Thread(
+        target=_refresh_traffic_matrix, args=(year_limit,), daemon=True
+    ).start()
+
+
+def _build_traffic_matrix(conn, year_limit):
+    """Compute the traffic matrix for the latest ``year_limit`` years."""
     years = [
         r["year"]
         for r in conn.execute(
@@ -1415,64 +2312,57 @@ def get_traffic_matrix():
         ).fetchall()
     ][:year_limit]
     if not years:
-        conn.close()
         return {"years": [], "metrics": {}}
     df = pd.read_sql_query(
         "SELECT year, month, source, sessions, avg_time, bounce_rate FROM hubspot_traffic WHERE year >= ?",
         conn,
         params=(years[-1],),
     )
-    conn.close()
 
     # Normalize source names to match TRAFFIC_SOURCES list
     df["source"] = df["source"].apply(_normalize_hubspot_source)
 
+    months = range(1, 13)
+    by_source = pd.MultiIndex.from_product(
+        [TRAFFIC_SOURCES, years, months], names=["source", "year", "month"]
+    )
+    by_month = pd.MultiIndex.from_product([years, months], names=["year", "month"])
+
+    def grid(series, index):
+        """Return ``series`` summed onto ``index`` as rows of 12 months."""
+        keys = list(index.names)
+        summed = series.groupby([df[k] for k in keys]).sum()
+        return summed.reindex(index, fill_value=0).to_numpy(dtype=float).reshape(-1, 12)
+
+    def month_values(grid_rows, average):
+        """Return month values with month-over-month diffs and a year total."""
+        values = []
+        for vals in grid_rows.tolist():
+            values.extend(
+                {"val": val, "diff": None if m == 0 else val - vals[m - 1]}
+                for m, val in enumerate(vals)
+            )
+            ytotal = sum(vals)
+            values.append({"val": ytotal / 12 if average else ytotal, "diff": None})
+        return values
+
+    sessions = grid(df["sessions"], by_month)
     metrics = {}
     for metric in ["sessions", "avg_time", "bounce_rate"]:
-        rows = []
-        for src in TRAFFIC_SOURCES:
-            values = []
-            for year in years:
-                ydf = df[(df["year"] == year) & (df["source"] == src)]
-                prev = None
-                for m in range(1, 13):
-                    val = float(ydf[ydf["month"] == m][metric].sum())
-                    diff = val - prev if prev is not None else None
-                    values.append({"val": val, "diff": diff})
-                    prev = val
-                ytotal = sum(v["val"] for v in values[-12:])
-                if metric != "sessions":
-                    ytotal = ytotal / 12 if values[-12:] else 0
-                values.append({"val": ytotal, "diff": None})
-            rows.append({"source": src, "values": values})
-
-        totals = []
-        for year in years:
-            ydf = df[df["year"] == year]
-            prev = None
-            for m in range(1, 13):
-                if metric == "sessions":
-                    val = ydf[ydf["month"] == m]["sessions"].sum()
-                else:
-                    sess = ydf[ydf["month"] == m]["sessions"].sum()
-                    val = (
-                        (
-                            ydf[ydf["month"] == m][metric]
-                            * ydf[ydf["month"] == m]["sessions"]
-                        ).sum()
-                        / sess
-                        if sess
-                        else 0
-                    )
-                diff = val - prev if prev is not None else None
-                totals.append({"val": float(val), "diff": diff})
-                prev = val
-            ytotal = sum(t["val"] for t in totals[-12:])
-            if metric != "sessions":
-                ytotal = ytotal / 12 if totals[-12:] else 0
-            totals.append({"val": ytotal, "diff": None})
-
-        metrics[metric] = {"rows": rows, "totals": totals}
+        average = metric != "sessions"
+        per_source = grid(df[metric], by_source).reshape(len(TRAFFIC_SOURCES), -1, 12)
+        rows = [
+            {"source": src, "values": month_values(per_source[i], average)}
+            for i, src in enumerate(TRAFFIC_SOURCES)
+        ]
+        if average:
+            # monthly averages across sources are weighted by sessions
+            weighted = grid(df[metric] * df["sessions"], by_month)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                overall = np.where(sessions != 0, weighted / sessions, 0.0)
+        else:
+            overall = sessions
+        metrics[metric] = {"rows": rows, "totals": month_values(overall, average)}
 
     return {"years": years, "metrics": metrics}
 
@@ -1488,25 +2378,11 @@ def generate_year_chart_base64(year, *, light=False):
         Use light mode chart styling regardless of theme.
     """
     conn = get_db()
-    shopify = pd.read_sql_query(
-        "SELECT created_at, sku, quantity, total FROM shopify", conn
+    summary = _load_summary(
+        conn, years=[year, year - 1], group_by=["year", "month_num"]
     )
-    qbo = pd.read_sql_query("SELECT created_at, sku, quantity, total FROM qbo", conn)
     conn.close()
 
-    all_data = _safe_concat([shopify, qbo])
-    all_data["quantity"] = pd.to_numeric(all_data["quantity"], errors="coerce").fillna(
-        0
-    )
-    all_data["total"] = pd.to_numeric(all_data["total"], errors="coerce").fillna(0)
-    all_data["created_at"] = pd.to_datetime(
-        all_data["created_at"].astype(str), errors="coerce", format="mixed", utc=True
-    ).dt.tz_localize(None)
-    all_data = all_data.dropna(subset=["created_at"])
-    all_data["year"] = all_data["created_at"].dt.year
-    all_data["month"] = all_data["created_at"].dt.strftime("%b")
-
-    summary = all_data.groupby(["year", "month"])["total"].sum().reset_index()
     this_year = summary[summary["year"] == year].set_index("month")
     last_year = summary[summary["year"] == year - 1].set_index("month")
 
@@ -1543,35 +2419,6 @@ def generate_last_month_chart_base64(year, month_param=None, *, light=False):
     light : bool, optional
         Use light mode chart styling regardless of theme.
     """
-    conn = get_db()
-    shopify = pd.read_sql_query(
-        "SELECT created_at, sku, quantity, total FROM shopify", conn
-    )
-    qbo = pd.read_sql_query("SELECT created_at, sku, quantity, total FROM qbo", conn)
-    mapping = pd.read_sql_query("SELECT alias, canonical_sku, type FROM sku_map", conn)
-    conn.close()
-
-    all_data = _safe_concat([shopify, qbo], ignore_index=True)
-    all_data["total"] = pd.to_numeric(all_data["total"], errors="coerce").fillna(0)
-    all_data["created_at"] = pd.to_datetime(
-        all_data["created_at"].astype(str), errors="coerce", format="mixed", utc=True
-    ).dt.tz_localize(None)
-    all_data = all_data.dropna(subset=["created_at"])
-
-    alias_map = mapping.set_index("alias")
-
-    def map_row(alias, field):
-        if isinstance(alias, str):
-            key = alias.lower().strip()
-            if key in alias_map.index:
-                return alias_map.loc[key, field]
-            return key if field == "canonical_sku" else "unmapped"
-        return alias if field == "canonical_sku" else "unmapped"
-
-    all_data["type"] = all_data["sku"].apply(lambda x: map_row(x, "type"))
-    all_data["year"] = all_data["created_at"].dt.year
-    all_data["month_num"] = all_data["created_at"].dt.month
-
     now = datetime.now()
     if month_param:
         last_year = year
@@ -1588,9 +2435,14 @@ def generate_last_month_chart_base64(year, month_param=None, *, light=False):
             last_year = year
             last_month = 12
 
-    summary = (
-        all_data.groupby(["year", "month_num", "type"])["total"].sum().reset_index()
+    conn = get_db()
+    summary = _load_summary(
+        conn,
+        years=[last_year, last_year - 1],
+        month=last_month,
+        group_by=["year", "month_num", "type"],
     )
+    conn.close()
 
     cur = summary[
         (summary["year"] == last_year) & (summary["month_num"] == last_month)
@@ -1642,24 +2494,32 @@ def generate_last_month_chart_base64(year, month_param=None, *, light=False):
 def monthly_report():
     year = request.args.get("year", default=datetime.now().year, type=int)
     month_param = request.args.get("month", type=int)
-    data = calculate_report_data(year, month_param)
+    report = report_context(year, month_param)
     year_limit = int(get_setting("reports_year_limit", "5") or 5)
-    data["years"] = sorted(data["years"], reverse=True)[:year_limit]
-    if year not in data["years"]:
-        data["years"].append(year)
-        data["years"] = sorted(data["years"], reverse=True)
-    data["shopify_years"] = data["shopify_years"][:year_limit]
-    for row in data["shopify_rows"]:
-        row["values"] = row["values"][: len(data["shopify_years"])]
-    data["shopify_totals"] = data["shopify_totals"][: len(data["shopify_years"])]
-    for row in data["shopify_quarters"]:
-        row["values"] = row["values"][: len(data["shopify_years"])]
-    data["default_tab"] = get_setting("reports_start_tab", "by-month")
-    data["categories"] = CATEGORIES
-    data["traffic_matrix"] = get_traffic_matrix()
-    data["include_marketing"] = get_setting("default_include_marketing", "1") == "1"
-    data["traffic_metric_labels"] = TRAFFIC_METRIC_LABELS
-    return render_template("report.html", **data)
+    years = sorted(report["years"], reverse=True)[:year_limit]
+    if year not in years:
+        years = sorted(years + [year], reverse=True)
+    shopify_years = report["shopify_years"][:year_limit]
+    return render_template(
+        "report.html",
+        report=report,
+        years=years,
+        shopify_years=shopify_years,
+        shopify_rows=[
+            dict(row, values=row["values"][: len(shopify_years)])
+            for row in report["shopify_rows"]
+        ],
+        shopify_totals=report["shopify_totals"][: len(shopify_years)],
+        shopify_quarters=[
+            dict(row, values=row["values"][: len(shopify_years)])
+            for row in report["shopify_quarters"]
+        ],
+        default_tab=get_setting("reports_start_tab", "by-month"),
+        categories=CATEGORIES,
+        traffic_matrix=get_traffic_matrix(),
+        include_marketing=get_setting("default_include_marketing", "1") == "1",
+        traffic_metric_labels=TRAFFIC_METRIC_LABELS,
+    )
 
 
 @app.route("/export-report", methods=["GET", "POST"])
@@ -1696,23 +2556,46 @@ def export_report():
         if not detail_types:
             default_types = get_setting("default_detail_types", ",".join(CATEGORIES))
             detail_types = [t for t in default_types.split(",") if t]
-        data = calculate_report_data(year, month)
+        # only compute the sections the PDF will show
+        sections = [
+            name
+            for name, wanted in (
+                ("last_month", include_month_summary),
+                ("sku_details", include_month_details),
+                ("overall", include_year_overall),
+                ("types", include_year_summary),
+                ("shopify", include_shopify),
+            )
+            if wanted
+        ]
+        data = report_context(year, month).sections(*sections)
         year_limit = int(get_setting("reports_year_limit", "5") or 5)
-        data["years"] = sorted(data["years"], reverse=True)[:year_limit]
-        if year not in data["years"]:
-            data["years"].append(year)
-            data["years"] = sorted(data["years"], reverse=True)
-        data["shopify_years"] = data["shopify_years"][:year_limit]
-        for row in data["shopify_rows"]:
-            row["values"] = row["values"][: len(data["shopify_years"])]
-        data["shopify_totals"] = data["shopify_totals"][: len(data["shopify_years"])]
-        for row in data["shopify_quarters"]:
-            row["values"] = row["values"][: len(data["shopify_years"])]
+        if include_year_overall:
+            data["years"] = sorted(data["years"], reverse=True)[:year_limit]
+            if year not in data["years"]:
+                data["years"].append(year)
+                data["years"] = sorted(data["years"], reverse=True)
+        if include_shopify:
+            data["shopify_years"] = data["shopify_years"][:year_limit]
+            data["shopify_rows"] = [
+                dict(row, values=row["values"][: len(data["shopify_years"])])
+                for row in data["shopify_rows"]
+            ]
+            data["shopify_totals"] = data["shopify_totals"][
+                : len(data["shopify_years"])
+            ]
+            data["shopify_quarters"] = [
+                dict(row, values=row["values"][: len(data["shopify_years"])])
+                for row in data["shopify_quarters"]
+            ]
         selected = [t for t in detail_types if t in CATEGORIES]
-        data["sku_details"] = {t: data["sku_details"].get(t, []) for t in selected}
-        data["has_month_details"] = any(
-            len(v) > 0 for v in data["sku_details"].values()
-        )
+        if include_month_details:
+            data["sku_details"] = {
+                t: data["sku_details"].get(t, []) for t in selected
+            }
+            data["has_month_details"] = any(
+                len(v) > 0 for v in data["sku_details"].values()
+            )
         data.update(
             {
                 "include_month_summary": include_month_summary,
@@ -1753,25 +2636,11 @@ def export_report():
 def report_chart():
     year = request.args.get("year", default=datetime.now().year, type=int)
     conn = get_db()
-    shopify = pd.read_sql_query(
-        "SELECT created_at, sku, quantity, total FROM shopify", conn
+    summary = _load_summary(
+        conn, years=[year, year - 1], group_by=["year", "month_num"]
     )
-    qbo = pd.read_sql_query("SELECT created_at, sku, quantity, total FROM qbo", conn)
     conn.close()
 
-    all_data = _safe_concat([shopify, qbo])
-    all_data["quantity"] = pd.to_numeric(all_data["quantity"], errors="coerce").fillna(
-        0
-    )
-    all_data["total"] = pd.to_numeric(all_data["total"], errors="coerce").fillna(0)
-    all_data["created_at"] = pd.to_datetime(
-        all_data["created_at"].astype(str), errors="coerce", format="mixed", utc=True
-    ).dt.tz_localize(None)
-    all_data = all_data.dropna(subset=["created_at"])
-    all_data["year"] = all_data["created_at"].dt.year
-    all_data["month"] = all_data["created_at"].dt.strftime("%b")
-
-    summary = all_data.groupby(["year", "month"])["total"].sum().reset_index()
     this_year = summary[summary["year"] == year].set_index("month")
     last_year = summary[summary["year"] == year - 1].set_index("month")
 
@@ -1812,25 +2681,8 @@ def transactions_page():
     if end in (None, "", "None"):
         end = None
     conn = get_db()
-    shopify = pd.read_sql_query(
-        "SELECT created_at, sku, description, quantity, price, total FROM shopify",
-        conn,
-    )
-    qbo_cols = [r["name"] for r in conn.execute("PRAGMA table_info(qbo)").fetchall()]
-    if "doc_type" in qbo_cols:
-        qbo = pd.read_sql_query(
-            "SELECT created_at, sku, description, quantity, price, total, doc_type FROM qbo",
-            conn,
-        )
-    else:
-        qbo = pd.read_sql_query(
-            "SELECT created_at, sku, description, quantity, price, total FROM qbo",
-            conn,
-        )
-        qbo["doc_type"] = ""
     mapping = pd.read_sql_query("SELECT alias, canonical_sku, type FROM sku_map", conn)
 
-    alias_map = mapping.set_index("alias")
     sku_options = sorted(
         mapping[
             (mapping["alias"] == mapping["canonical_sku"])
@@ -1838,31 +2690,19 @@ def transactions_page():
         ]["canonical_sku"].unique()
     )
 
-    def parse_dates(df):
-        df["created_at"] = pd.to_datetime(
-            df["created_at"].astype(str), errors="coerce", format="mixed", utc=True
-        ).dt.tz_localize(None)
-        df.dropna(subset=["created_at"], inplace=True)
-        return df
-
-    shopify = parse_dates(shopify)
-    qbo = parse_dates(qbo)
-
-    all_dates_raw = _safe_concat(
-        [
-            shopify[["created_at"]],
-            qbo[["created_at"]],
-        ]
-    )["created_at"]
-    all_dates = pd.to_datetime(all_dates_raw, errors="coerce").dropna()
-    years = sorted(all_dates.dt.year.unique(), reverse=True)
-    month_periods = sorted(all_dates.dt.to_period("M").unique(), reverse=True)
+    # period choices only need the months that have data, not the rows
+    all_months = conn.execute(
+        "SELECT DISTINCT year, month FROM shopify WHERE created_ts IS NOT NULL "
+        "UNION SELECT DISTINCT year, month FROM qbo WHERE created_ts IS NOT NULL "
+        "ORDER BY year DESC, month DESC"
+    ).fetchall()
+    years = sorted({r["year"] for r in all_months}, reverse=True)
     month_options = [
         {
-            "value": f"month-{p.year}-{p.month:02d}",
-            "label": p.strftime("%b %Y"),
+            "value": f"month-{r['year']}-{r['month']:02d}",
+            "label": datetime(r["year"], r["month"], 1).strftime("%b %Y"),
         }
-        for p in month_periods
+        for r in all_months
     ]
     current_quarter = (datetime.now().month - 1) // 3 + 1
     current_year = datetime.now().year
@@ -1892,14 +2732,6 @@ def transactions_page():
     elif period == "custom" or start or end:
         period_type = "custom"
 
-    def canonical(alias):
-        if isinstance(alias, str):
-            key = alias.lower().strip()
-            if key in alias_map.index:
-                return alias_map.loc[key, "canonical_sku"]
-            return key
-        return alias
-
     if not start and not end:
         if period.startswith("year-"):
             year_num = int(period.split("-")[1])
@@ -1928,16 +2760,36 @@ def transactions_page():
     start_dt = pd.to_datetime(start) if start else None
     end_dt = pd.to_datetime(end) if end else None
 
+    where, params = _created_range(start_dt, end_dt)
+    shopify = pd.read_sql_query(
+        "SELECT created_ts, sku, description, quantity, price, total "
+        f"FROM shopify WHERE {where} ORDER BY rowid",
+        conn,
+        params=params,
+    )
+    qbo_cols = [r["name"] for r in conn.execute("PRAGMA table_info(qbo)").fetchall()]
+    if "doc_type" in qbo_cols:
+        qbo = pd.read_sql_query(
+            "SELECT created_ts, sku, description, quantity, price, total, doc_type "
+            f"FROM qbo WHERE {where} ORDER BY rowid",
+            conn,
+            params=params,
+        )
+    else:
+        qbo = pd.read_sql_query(
+            "SELECT created_ts, sku, description, quantity, price, total "
+            f"FROM qbo WHERE {where} ORDER BY rowid",
+            conn,
+            params=params,
+        )
+        qbo["doc_type"] = ""
+
     def process(df):
-        df = df.copy()
-        df["canonical"] = df["sku"].apply(canonical)
+        df.insert(0, "created_at", created_datetime(df.pop("created_ts")))
+        df["canonical"] = _resolve_skus(df["sku"], mapping)[0]
         df["quantity"] = pd.to_numeric(df["quantity"], errors="coerce").fillna(0)
         df["price"] = pd.to_numeric(df["price"], errors="coerce").fillna(0)
         df["total"] = pd.to_numeric(df["total"], errors="coerce").fillna(0)
-        if start_dt is not None:
-            df = df[df["created_at"] >= start_dt]
-        if end_dt is not None:
-            df = df[df["created_at"] <= end_dt]
         return df
 
     shopify = process(shopify)
@@ -2039,35 +2891,6 @@ def transactions_page():
 def last_month_chart():
     year = request.args.get("year", default=datetime.now().year, type=int)
     month_param = request.args.get("month", type=int)
-    conn = get_db()
-    shopify = pd.read_sql_query(
-        "SELECT created_at, sku, quantity, total FROM shopify", conn
-    )
-    qbo = pd.read_sql_query("SELECT created_at, sku, quantity, total FROM qbo", conn)
-    mapping = pd.read_sql_query("SELECT alias, canonical_sku, type FROM sku_map", conn)
-    conn.close()
-
-    all_data = _safe_concat([shopify, qbo], ignore_index=True)
-    all_data["total"] = pd.to_numeric(all_data["total"], errors="coerce").fillna(0)
-    all_data["created_at"] = pd.to_datetime(
-        all_data["created_at"].astype(str), errors="coerce", format="mixed", utc=True
-    ).dt.tz_localize(None)
-    all_data = all_data.dropna(subset=["created_at"])
-
-    alias_map = mapping.set_index("alias")
-
-    def map_row(alias, field):
-        if isinstance(alias, str):
-            key = alias.lower().strip()
-            if key in alias_map.index:
-                return alias_map.loc[key, field]
-            return key if field == "canonical_sku" else "unmapped"
-        return alias if field == "canonical_sku" else "unmapped"
-
-    all_data["type"] = all_data["sku"].apply(lambda x: map_row(x, "type"))
-    all_data["year"] = all_data["created_at"].dt.year
-    all_data["month_num"] = all_data["created_at"].dt.month
-
     now = datetime.now()
     if month_param:
         last_year = year
@@ -2084,9 +2907,14 @@ def last_month_chart():
             last_year = year
             last_month = 12
 
-    summary = (
-        all_data.groupby(["year", "month_num", "type"])["total"].sum().reset_index()
+    conn = get_db()
+    summary = _load_summary(
+        conn,
+        years=[last_year, last_year - 1],
+        month=last_month,
+        group_by=["year", "month_num", "type"],
     )
+    conn.close()
 
     categories = CATEGORIES
     labels = CATEGORY_LABELS
@@ -2137,41 +2965,14 @@ def last_month_chart():
 def sku_detail(sku):
     """Display total quantity and sales for a SKU broken down by source."""
     conn = get_db()
-    shopify = pd.read_sql_query(
-        "SELECT created_at, sku, quantity, total FROM shopify", conn
-    )
-    qbo = pd.read_sql_query("SELECT created_at, sku, quantity, total FROM qbo", conn)
-    mapping = pd.read_sql_query("SELECT alias, canonical_sku FROM sku_map", conn)
+    totals = _load_summary(conn, group_by=["canonical", "source"])
     conn.close()
 
-    alias_map = mapping.set_index("alias")
-
-    def canonical(alias):
-        if isinstance(alias, str):
-            key = alias.lower().strip()
-            if key in alias_map.index:
-                return alias_map.loc[key, "canonical_sku"]
-            return key
-        return alias
-
-    for df in (shopify, qbo):
-        df["canonical"] = df["sku"].apply(canonical)
-        df["quantity"] = pd.to_numeric(df["quantity"], errors="coerce").fillna(0)
-        df["total"] = pd.to_numeric(df["total"], errors="coerce").fillna(0)
-
-    s_df = shopify[shopify["canonical"] == sku]
-    q_df = qbo[qbo["canonical"] == sku]
-
-    summary = {
-        "shopify": {
-            "quantity": s_df["quantity"].sum(),
-            "total": s_df["total"].sum(),
-        },
-        "qbo": {
-            "quantity": q_df["quantity"].sum(),
-            "total": q_df["total"].sum(),
-        },
-    }
+    totals = totals[totals["canonical"] == sku]
+    summary = {}
+    for src in ("shopify", "qbo"):
+        df = totals[totals["source"] == src]
+        summary[src] = {"quantity": df["quantity"].sum(), "total": df["total"].sum()}
     return render_template("sku_summary.html", sku=sku, summary=summary)
 
 
@@ -2182,29 +2983,17 @@ def sku_transactions(sku, source):
         return abort(404)
     conn = get_db()
     df = pd.read_sql_query(
-        f"SELECT created_at, sku, description, price, quantity, total FROM {source}",
+        f"SELECT created_ts, sku, description, price, quantity, total FROM {source}",
         conn,
     )
     mapping = pd.read_sql_query("SELECT alias, canonical_sku FROM sku_map", conn)
     conn.close()
 
-    alias_map = mapping.set_index("alias")
-
-    def canonical(alias):
-        if isinstance(alias, str):
-            key = alias.lower().strip()
-            if key in alias_map.index:
-                return alias_map.loc[key, "canonical_sku"]
-            return key
-        return alias
-
-    df["canonical"] = df["sku"].apply(canonical)
+    df["canonical"] = _resolve_skus(df["sku"], mapping)[0]
     df["quantity"] = pd.to_numeric(df["quantity"], errors="coerce").fillna(0)
     df["price"] = pd.to_numeric(df["price"], errors="coerce").fillna(0)
     df["total"] = pd.to_numeric(df["total"], errors="coerce").fillna(0)
-    df["created_at"] = pd.to_datetime(
-        df["created_at"].astype(str), errors="coerce", format="mixed", utc=True
-    ).dt.tz_localize(None)
+    df.insert(0, "created_at", created_datetime(df.pop("created_ts")))
     df = df[df["canonical"] == sku].dropna(subset=["created_at"])
 
     years = sorted(df["created_at"].dt.year.dropna().unique(), reverse=True)
@@ -2277,11 +3066,69 @@ def resolve_duplicate():
         qid,
         action if action in {"shopify", "qbo", "both"} else "both",
     )
+    bump_data_version(conn)
     conn.commit()
     conn.close()
     return jsonify(success=True)
 
 
+@app.route("/resolve-duplicates", methods=["POST"])
+def resolve_duplicates():
+    """Resolve many duplicate pairs in one transaction.
+
+    The JSON body either lists ``pairs`` as ``[shopify_id, qbo_id, action]``
+    entries or gives one ``action`` for every pair that is neither ignored
+    nor unmatched, optionally narrowed by ``sku``, ``start`` and ``end``.
+    Ignored and unknown pairs are skipped, and so are unmatched pairs unless
+    they are listed explicitly.
+    """
+    data = request.get_json(silent=True) or {}
+    actions = {"shopify", "qbo", "both"}
+    if "pairs" in data:
+        try:
+            wanted = {
+                (int(sid), int(qid)): action if action in actions else "both"
+                for sid, qid, action in data["pairs"]
+            }
+        except (TypeError, ValueError):
+            return jsonify(success=False), 400
+        filters = {}
+    else:
+        action = data.get("action")
+        if action not in actions:
+            return jsonify(success=False), 400
+        sku = data.get("sku")
+        start, end = data.get("start"), data.get("end")
+        wanted = None
+        filters = {
+            "sku": None if not sku or sku == "all" else sku,
+            "start": pd.to_datetime(start) if start else None,
+            "end": pd.to_datetime(end) if end else None,
+        }
+
+    conn = get_db()
+    resolutions = []
+    skipped = 0
+    for p in _find_duplicates(conn, **filters):
+        key = (p["shopify_id"], p["qbo_id"])
+        if wanted is not None and key not in wanted:
+            continue
+        if p["ignored"] or (wanted is None and p["unmatched"]):
+            skipped += 1
+            continue
+        resolutions.append((p, action if wanted is None else wanted[key]))
+    if wanted is not None:
+        skipped = len(wanted) - len(resolutions)
+    deleted = _apply_resolutions(conn, resolutions)
+    if resolutions:
+        bump_data_version(conn)
+    conn.commit()
+    conn.close()
+    return jsonify(
+        success=True, resolved=len(resolutions), skipped=skipped, deleted=deleted
+    )
+
+
 @app.route("/unmatch-duplicate", methods=["POST"])
 def unmatch_duplicate():
     """Reopen a resolved duplicate for manual review."""
@@ -2291,8 +3138,10 @@ def unmatch_duplicate():
         return jsonify(success=False), 400
     conn = get_db()
     row = conn.execute(
-        "SELECT action, sku, quantity, total, shopify_desc, qbo_desc, "
-        "shopify_created_at, qbo_created_at FROM duplicate_log "
+        "SELECT action, COALESCE(shopify_sku, sku) AS shopify_sku, "
+        "COALESCE(qbo_sku, sku) AS qbo_sku, quantity, total, shopify_desc, "
+        "qbo_desc, shopify_created_at, qbo_created_at, deleted_hash "
+        "FROM duplicate_log "
         "WHERE shopify_id=? AND qbo_id=? ORDER BY resolved_at DESC LIMIT 1",
         (sid, qid),
     ).fetchone()
@@ -2300,38 +3149,53 @@ def unmatch_duplicate():
     if row:
         price = row["total"] / row["quantity"] if row["quantity"] else 0
         if row["action"] == "shopify":
+            ensure_line_hashes(conn, "qbo")
             cur = conn.execute(
-                "INSERT INTO qbo(created_at, sku, description, quantity, price, total) "
-                "VALUES(?,?,?,?,?,?)",
+                "INSERT INTO qbo(created_at, created_ts, year, month, sku, description, quantity, price, total, line_hash) "
+                "VALUES(?,?,?,?,?,?,?,?,?,?)",
                 (
                     row["qbo_created_at"],
-                    row["sku"],
+                    *timestamp_parts(row["qbo_created_at"]),
+                    row["qbo_sku"],
                     row["qbo_desc"],
                     row["quantity"],
                     price,
                     row["total"],
+                    row["deleted_hash"],
                 ),
             )
             new_qid = cur.lastrowid
+            bump_data_version(conn, "transactions")
+            _adjust_rollup(conn, "qbo", [new_qid], 1)
+            ensure_sku_keys(conn, "qbo")
+            index_duplicate_candidates(conn, "qbo")
         elif row["action"] == "qbo":
+            ensure_line_hashes(conn, "shopify")
             cur = conn.execute(
-                "INSERT INTO shopify(created_at, sku, description, quantity, price, total) "
-                "VALUES(?,?,?,?,?,?)",
+                "INSERT INTO shopify(created_at, created_ts, year, month, sku, description, quantity, price, total, line_hash) "
+                "VALUES(?,?,?,?,?,?,?,?,?,?)",
                 (
                     row["shopify_created_at"],
-                    row["sku"],
+                    *timestamp_parts(row["shopify_created_at"]),
+                    row["shopify_sku"],
                     row["shopify_desc"],
                     row["quantity"],
                     price,
                     row["total"],
+                    row["deleted_hash"],
                 ),
             )
             new_sid = cur.lastrowid
+            bump_data_version(conn, "transactions")
+            _adjust_rollup(conn, "shopify", [new_sid], 1)
+            ensure_sku_keys(conn, "shopify")
+            index_duplicate_candidates(conn, "shopify")
     conn.execute(
         'UPDATE duplicate_log SET action="unmatched", ignored=0, shopify_id=?, qbo_id=? '
         "WHERE shopify_id=? AND qbo_id=?",
         (new_sid, new_qid, sid, qid),
     )
+    bump_data_version(conn)
     conn.commit()
     conn.close()
     return jsonify(success=True)
@@ -2350,10 +3214,7 @@ def ignore_duplicate():
         (sid, qid),
     )
     if cur.rowcount == 0:
-        pairs = _find_duplicates(conn)
-        row = next(
-            (p for p in pairs if p["shopify_id"] == sid and p["qbo_id"] == qid), None
-        )
+        row = next(iter(_find_duplicates(conn, pair=(sid, qid))), None)
         if row:
             conn.execute(
                 "INSERT INTO duplicate_log(resolved_at, shopify_id, qbo_id, action, sku, shopify_sku, qbo_sku, quantity, total, shopify_desc, qbo_desc, created_at, shopify_created_at, qbo_created_at, ignored) "
@@ -2380,6 +3241,7 @@ def ignore_duplicate():
                 "INSERT INTO duplicate_log(resolved_at, shopify_id, qbo_id, action, ignored) VALUES (?,?,?,?,1)",
                 (datetime.now(timezone.utc).isoformat(), sid, qid, "both"),
             )
+    bump_data_version(conn)
     conn.commit()
     conn.close()
     return jsonify(success=True)
@@ -2397,6 +3259,7 @@ def unignore_duplicate():
         "UPDATE duplicate_log SET ignored=0 WHERE shopify_id=? AND qbo_id=?",
         (sid, qid),
     )
+    bump_data_version(conn)
     conn.commit()
     conn.close()
     return jsonify(success=True)
@@ -2442,6 +3305,9 @@ def settings_page():
         include_shopify = "include_shopify" in request.form
         include_marketing = "include_marketing" in request.form
         reports_start_tab = request.form.get("reports_start_tab", "by-month")
+        report_backend = request.form.get("report_backend", "rollup")
+        if report_backend not in REPORT_BACKENDS:
+            report_backend = "rollup"
         year_limit_val = request.form.get("reports_year_limit", "5")
         try:
             year_limit = int(year_limit_val)
@@ -2475,6 +3341,7 @@ def settings_page():
                 ("default_include_marketing", "1" if include_marketing else "0"),
                 ("reports_start_tab", reports_start_tab),
                 ("reports_year_limit", str(max(1, year_limit))),
+                ("report_backend", report_backend),
             ]
         )
         shopify_domain = request.form.get("shopify_domain", "").strip()
@@ -2515,6 +3382,7 @@ def settings_page():
         if dup_action in {"shopify", "qbo", "both"} and dup_action != prev_dup_action:
             conn = get_db()
             _resolve_duplicates(conn, dup_action)
+            bump_data_version(conn)
             conn.commit()
             conn.close()
         logo_file = request.files.get("logo")
@@ -2564,6 +3432,7 @@ def settings_page():
     include_marketing = get_setting("default_include_marketing", "1") == "1"
     reports_start_tab = get_setting("reports_start_tab", "by-month")
     year_limit = int(get_setting("reports_year_limit", "5") or 5)
+    report_backend = _report_backend()
     dup_action = get_setting("duplicate_action", "review")
     tx_source_default = get_setting("transactions_default_source", "both")
     tx_period_default = get_setting("transactions_default_period", "last30")
@@ -2585,7 +3454,7 @@ def settings_page():
     app_logo_path = get_setting("app_logo", "")
     month_default = get_setting("default_export_month", "")
     month_int = int(month_default) if str(month_default).isdigit() else None
-    months = calculate_report_data(datetime.now().year)["months"]
+    months = report_context(datetime.now().year)["months"]
     return render_template(
         "settings.html",
         primary_color=primary_color,
@@ -2617,6 +3486,7 @@ def settings_page():
         tx_period_default=tx_period_default,
         reports_start_tab=reports_start_tab,
         reports_year_limit=year_limit,
+        report_backend=report_backend,
         shopify_domain=shopify_domain,
         shopify_token=shopify_token,
         shopify_last_sync=shopify_last_sync,
@@ -2691,7 +3561,17 @@ def sync_shopify_data():
 
     conn = get_db()
     mode = "replace" if first_batch else "append"
+    appended_after = (
+        None
+        if first_batch
+        else conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM shopify").fetchone()[0]
+    )
     df.to_sql("shopify", conn, if_exists=mode, index=False)
+    _sync_rollup(conn, "shopify", appended_after)
+    conn.execute("DELETE FROM uploads WHERE source='shopify'")
+    ensure_transaction_indexes(conn)
+    ensure_sku_keys(conn, "shopify")
+    index_duplicate_candidates(conn, "shopify", rebuild=first_batch)
     for o in orders:
         o["shopify_id"] = o.get("id")
         upsert_record(conn, "shopify_orders", o, "shopify_id")
@@ -2708,11 +3588,13 @@ def sync_shopify_data():
             "INSERT INTO shopify_lines(order_id, line_num, data) VALUES (?, ?, ?)",
             (item["order_id"], item["line_num"], json.dumps(item["data"])),
         )
+    bump_data_version(conn)
     conn.commit()
 
     if next_cursor is None:
         sku_df = pd.read_sql_query("SELECT sku FROM shopify", conn)
-        _update_sku_map(conn, sku_df["sku"], "shopify")
+        new_aliases = _update_sku_map(conn, sku_df["sku"], "shopify")
+        _rebuild_rollup(conn)
         if action in {"shopify", "qbo", "both"}:
             _resolve_duplicates(conn, action)
         row = conn.execute(
@@ -2729,10 +3611,11 @@ def sync_shopify_data():
                 now,
             ),
         )
+        bump_data_version(conn)
         conn.commit()
         conn.close()
         set_setting("shopify_last_sync", now)
-        return jsonify(success=True, next=None, done=True)
+        return jsonify(success=True, next=None, done=True, new_aliases=new_aliases)
     conn.close()
     return jsonify(success=True, next=next_cursor, page=page + 1, done=False)
 
@@ -2888,7 +3771,17 @@ def sync_qbo_data():
 
     conn = get_db()
     mode = "replace" if first_batch else "append"
+    appended_after = (
+        None
+        if first_batch
+        else conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM qbo").fetchone()[0]
+    )
     df.to_sql("qbo", conn, if_exists=mode, index=False)
+    _sync_rollup(conn, "qbo", appended_after)
+    conn.execute("DELETE FROM uploads WHERE source='qbo'")
+    ensure_transaction_indexes(conn)
+    ensure_sku_keys(conn, "qbo")
+    index_duplicate_candidates(conn, "qbo", rebuild=first_batch)
     if first_batch:
         conn.execute("DELETE FROM qbo_docs")
         conn.execute("DELETE FROM qbo_lines")
@@ -2915,6 +3808,7 @@ def sync_qbo_data():
         for inv in invoices:
             inv["qbo_id"] = str(inv.get("Id") or "")
             upsert_record(conn, "qbo_invoices", inv, "qbo_id")
+    bump_data_version(conn)
     conn.commit()
 
     done = next_pos is None
@@ -2924,13 +3818,16 @@ def sync_qbo_data():
         done = False
         next_pos = 1
 
+    new_aliases = 0
     if done and doc_type == "Invoice":
         sku_df = pd.read_sql_query("SELECT sku FROM qbo", conn)
         prod_df = pd.read_sql_query('SELECT "Sku" as sku FROM qbo_products', conn)
         sku_series = pd.concat([sku_df["sku"], prod_df["sku"]], ignore_index=True)
-        _update_sku_map(conn, sku_series, "qbo")
+        new_aliases = _update_sku_map(conn, sku_series, "qbo")
+        _rebuild_rollup(conn)
         if action in {"shopify", "qbo", "both"}:
             _resolve_duplicates(conn, action)
+        bump_data_version(conn)
         row = conn.execute(
             "SELECT MIN(created_at), MAX(created_at) FROM qbo"
         ).fetchone()
@@ -2950,7 +3847,13 @@ def sync_qbo_data():
         set_setting("qbo_last_sync", now, conn)
     conn.commit()
     conn.close()
-    return jsonify(success=True, next=next_pos, doc_type=next_doc, done=done)
+    return jsonify(
+        success=True,
+        next=next_pos,
+        doc_type=next_doc,
+        done=done,
+        new_aliases=new_aliases,
+    )
 
 
 @app.route("/test-hubspot", methods=["POST"])
@@ -3015,10 +3918,15 @@ def sync_hubspot_data():
             )
         except Exception as exc:
             log_error(f"HubSpot sync error: {exc}")
+    bump_data_version(conn, "hubspot")
+
+    done = next_year is None
+    if done:
+        for limit in sorted(set(TRAFFIC_YEAR_LIMITS) | {year_limit}):
+            _store_traffic_matrix(conn, limit)
     conn.commit()
     conn.close()
 
-    done = next_year is None
     if done:
         now = datetime.now(timezone.utc).isoformat()
         set_setting("hubspot_last_sync", now)
@@ -3032,6 +3940,48 @@ def traffic_matrix_api():
     return jsonify(get_traffic_matrix())
 
 
+@app.route("/stats")
+def app_stats():
+    """Return cache and connection pool statistics as JSON."""
+    return jsonify(report_cache=REPORT_CACHE.stats(), db_pool=pool_stats())
+
+
+def _same_report(a, b):
+    """Return True if two report data structures match within float noise."""
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_same_report(a[k], b[k]) for k in a)
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(_same_report(x, y) for x, y in zip(a, b))
+    if isinstance(a, (int, float, np.number)) and isinstance(
+        b, (int, float, np.number)
+    ):
+        if pd.isna(a) or pd.isna(b):
+            return pd.isna(a) and pd.isna(b)
+        return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6)
+    return a == b
+
+
+@app.route("/report-backends")
+def compare_report_backends():
+    """Time each report backend for a year and check the results agree."""
+    year = request.args.get("year", default=datetime.now().year, type=int)
+    month_param = request.args.get("month", type=int)
+    results = {}
+    timings = {}
+    for backend in REPORT_BACKENDS:
+        started = time.perf_counter()
+        results[backend] = ReportContext(year, month_param, backend).as_dict()
+        timings[backend] = round(time.perf_counter() - started, 4)
+    baseline, *others = REPORT_BACKENDS
+    return jsonify(
+        year=year,
+        month=month_param,
+        seconds=timings,
+        active=_report_backend(),
+        equal=all(_same_report(results[baseline], results[b]) for b in others),
+    )
+
+
 @app.route("/clear-sync-data", methods=["POST"])
 def clear_sync_data():
     """Remove all previously synced data from the database."""
@@ -3039,7 +3989,14 @@ def clear_sync_data():
     for table in ("shopify", "shopify_orders", "qbo", "qbo_docs", "hubspot_traffic"):
         conn.execute(f"DELETE FROM {table}")
     conn.execute("DELETE FROM meta")
+    conn.execute("DELETE FROM uploads")
     conn.execute("DELETE FROM duplicate_log")
+    conn.execute("DELETE FROM duplicate_candidates")
+    conn.execute("DELETE FROM traffic_matrix_cache")
+    bump_data_version(conn, "transactions")
+    _rebuild_rollup(conn)
+    bump_data_version(conn)
+    bump_data_version(conn, "hubspot")
     conn.commit()
     conn.close()
     set_setting("shopify_last_sync", "")
@@ -3083,4 +4040,5 @@ def clear_api_responses_route():
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     app.run(debug=True)
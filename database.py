@@ -1,9 +1,17 @@
 import os
+import secrets
 import sqlite3
 
 import sys
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, timezone
 
+import pandas as pd
+
+from utils.ingest import HASH_COLUMNS, line_hashes, normalize_created_at
+
 
 if getattr(sys, "frozen", False):
     base_dir = os.path.join(os.path.expanduser("~"), "ultrasuite")
@@ -12,23 +20,121 @@ else:
 
 UPLOAD_FOLDER = os.path.join(base_dir, "uploads")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+SNAPSHOT_FOLDER = os.path.join(base_dir, "snapshots")
 DB_PATH = os.path.join(base_dir, "finance.db")
 
 
+# Idle connections kept for reuse. Flask's threaded server starts a thread
+# per request, so idle connections are shared by the process rather than
+# tied to one thread; a checked out connection is only used by its caller.
+POOL_MAX_IDLE = 8
+
+_pool_lock = threading.Lock()
+_pool = {"pid": None, "path": None, "idle": []}
+_pool_stats = {"opens": 0, "reuses": 0, "discards": 0, "wait_seconds": 0.0}
+
+
+class PooledConnection(sqlite3.Connection):
+    """SQLite connection that goes back to the pool when closed.
+
+    ``close()`` rolls back anything left uncommitted, matching what closing
+    a plain connection does, and keeps the connection for the next
+    ``get_db()`` call.
+    """
+
+    _idle = False
+    _timeout = None
+
+    def close(self):
+        if self._idle:
+            return
+        try:
+            self.rollback()
+        except sqlite3.Error:
+            _discard(self)
+            return
+        with _pool_lock:
+            if (
+                _pool["pid"] == os.getpid()
+                and _pool["path"] == DB_PATH
+                and len(_pool["idle"]) < POOL_MAX_IDLE
+            ):
+                self._idle = True
+                _pool["idle"].append(self)
+                return
+        _discard(self)
+
+
+def _discard(conn):
+    with _pool_lock:
+        _pool_stats["discards"] += 1
+    sqlite3.Connection.close(conn)
+
+
 def get_db(timeout=30.0):
     """Return a SQLite connection with a longer timeout.
 
     A 30 second timeout reduces ``database is locked`` errors when multiple
     writes occur concurrently. WAL mode is enabled to improve concurrency.
+    Connections come from a pool, so the pragmas are only applied when a
+    new connection is opened. Call ``close()`` to hand it back.
     """
-    conn = sqlite3.connect(DB_PATH, timeout=timeout)
+    started = time.perf_counter()
+    conn = None
+    with _pool_lock:
+        if _pool["pid"] != os.getpid() or _pool["path"] != DB_PATH:
+            # forked workers and a moved database start with an empty pool
+            _pool.update(pid=os.getpid(), path=DB_PATH, idle=[])
+        if _pool["idle"]:
+            conn = _pool["idle"].pop()
+            conn._idle = False
+            _pool_stats["reuses"] += 1
+    if conn is None:
+        conn = sqlite3.connect(
+            DB_PATH,
+            timeout=timeout,
+            factory=PooledConnection,
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        with _pool_lock:
+            _pool_stats["opens"] += 1
+        conn._timeout = timeout
+    elif conn._timeout != timeout:
+        conn.execute(f"PRAGMA busy_timeout={int(timeout * 1000)}")
+        conn._timeout = timeout
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
+    with _pool_lock:
+        _pool_stats["wait_seconds"] += time.perf_counter() - started
     return conn
 
 
-def init_db():
-    conn = get_db()
+@contextmanager
+def db_session(timeout=30.0):
+    """Yield a pooled connection that commits on success.
+
+    Any exception rolls the transaction back before it propagates.
+    """
+    conn = get_db(timeout)
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def pool_stats():
+    """Return connection pool counters."""
+    with _pool_lock:
+        stats = dict(_pool_stats, idle=len(_pool["idle"]))
+    stats["wait_seconds"] = round(stats["wait_seconds"], 6)
+    return stats
+
+
+def init_db(conn):
     c = conn.cursor()
     c.execute(
         "CREATE TABLE IF NOT EXISTS meta ("
@@ -71,60 +177,43 @@ def init_db():
         "ignored INTEGER DEFAULT 0"
         ")"
     )
-    conn.commit()
-    conn.close()
 
 
-def migrate_types():
-    conn = get_db()
+def migrate_types(conn):
     conn.execute("UPDATE sku_map SET type='parts' WHERE type='maintenance'")
-    conn.commit()
-    conn.close()
 
 
-def migrate_meta():
+def migrate_meta(conn):
     """Ensure new columns exist in the meta table."""
-    conn = get_db()
     cols = [row["name"] for row in conn.execute("PRAGMA table_info(meta)").fetchall()]
     if "last_transaction" not in cols:
         conn.execute("ALTER TABLE meta ADD COLUMN last_transaction TEXT")
-        conn.commit()
     if "first_transaction" not in cols:
         conn.execute("ALTER TABLE meta ADD COLUMN first_transaction TEXT")
-        conn.commit()
     if "last_synced" not in cols:
         conn.execute("ALTER TABLE meta ADD COLUMN last_synced TEXT")
-        conn.commit()
-    conn.close()
 
 
-def migrate_sku_source():
+def migrate_sku_source(conn):
     """Ensure source column exists in the sku_map table."""
-    conn = get_db()
     cols = [
         row["name"] for row in conn.execute("PRAGMA table_info(sku_map)").fetchall()
     ]
     if "source" not in cols:
         conn.execute("ALTER TABLE sku_map ADD COLUMN source TEXT")
-        conn.commit()
-    conn.close()
 
 
-def migrate_sku_changed():
+def migrate_sku_changed(conn):
     """Ensure changed_at column exists in the sku_map table."""
-    conn = get_db()
     cols = [
         row["name"] for row in conn.execute("PRAGMA table_info(sku_map)").fetchall()
     ]
     if "changed_at" not in cols:
         conn.execute("ALTER TABLE sku_map ADD COLUMN changed_at TEXT")
-        conn.commit()
-    conn.close()
 
 
-def migrate_duplicate_log():
+def migrate_duplicate_log(conn):
     """Ensure duplicate_log table exists."""
-    conn = get_db()
     conn.execute(
         "CREATE TABLE IF NOT EXISTS duplicate_log ("
         "resolved_at TEXT, "
@@ -148,38 +237,27 @@ def migrate_duplicate_log():
     ]
     if "created_at" not in cols:
         conn.execute("ALTER TABLE duplicate_log ADD COLUMN created_at TEXT")
-        conn.commit()
     if "shopify_created_at" not in cols:
         conn.execute("ALTER TABLE duplicate_log ADD COLUMN shopify_created_at TEXT")
-        conn.commit()
     if "qbo_created_at" not in cols:
         conn.execute("ALTER TABLE duplicate_log ADD COLUMN qbo_created_at TEXT")
-        conn.commit()
     if "shopify_sku" not in cols:
         conn.execute("ALTER TABLE duplicate_log ADD COLUMN shopify_sku TEXT")
-        conn.commit()
     if "qbo_sku" not in cols:
         conn.execute("ALTER TABLE duplicate_log ADD COLUMN qbo_sku TEXT")
-        conn.commit()
     if "ignored" not in cols:
         conn.execute("ALTER TABLE duplicate_log ADD COLUMN ignored INTEGER DEFAULT 0")
-        conn.commit()
-    conn.commit()
-    conn.close()
 
 
-def migrate_shopify_orders():
+def migrate_shopify_orders(conn):
     """Ensure table for raw Shopify orders exists."""
-    conn = get_db()
     conn.execute(
         "CREATE TABLE IF NOT EXISTS shopify_orders (order_id INTEGER PRIMARY KEY, data TEXT)"
     )
-    conn.close()
 
 
-def migrate_shopify_lines():
+def migrate_shopify_lines(conn):
     """Ensure table for raw Shopify line items exists."""
-    conn = get_db()
     conn.execute(
         "CREATE TABLE IF NOT EXISTS shopify_lines ("
         "order_id INTEGER, "
@@ -188,21 +266,17 @@ def migrate_shopify_lines():
         "PRIMARY KEY (order_id, line_num)"
         ")"
     )
-    conn.close()
 
 
-def migrate_qbo_docs():
+def migrate_qbo_docs(conn):
     """Ensure table for raw QBO documents exists."""
-    conn = get_db()
     conn.execute(
         "CREATE TABLE IF NOT EXISTS qbo_docs (doc_id TEXT PRIMARY KEY, data TEXT)"
     )
-    conn.close()
 
 
-def migrate_qbo_lines():
+def migrate_qbo_lines(conn):
     """Ensure table for raw QBO line items exists."""
-    conn = get_db()
     conn.execute(
         "CREATE TABLE IF NOT EXISTS qbo_lines ("
         "doc_id TEXT, "
@@ -211,19 +285,15 @@ def migrate_qbo_lines():
         "PRIMARY KEY (doc_id, line_num)"
         ")"
     )
-    conn.close()
 
 
-def migrate_app_log():
+def migrate_app_log(conn):
     """Ensure table for application logs exists."""
-    conn = get_db()
     conn.execute("CREATE TABLE IF NOT EXISTS app_log (logged_at TEXT, message TEXT)")
-    conn.close()
 
 
-def migrate_hubspot_traffic():
+def migrate_hubspot_traffic(conn):
     """Ensure table for HubSpot traffic analytics exists."""
-    conn = get_db()
     conn.execute(
         "CREATE TABLE IF NOT EXISTS hubspot_traffic ("
         "year INTEGER, "
@@ -235,12 +305,10 @@ def migrate_hubspot_traffic():
         "PRIMARY KEY (year, month, source)"
         ")"
     )
-    conn.close()
 
 
-def migrate_api_responses():
+def migrate_api_responses(conn):
     """Ensure table for storing API responses exists."""
-    conn = get_db()
     conn.execute(
         "CREATE TABLE IF NOT EXISTS api_response ("
         "logged_at TEXT, "
@@ -249,14 +317,480 @@ def migrate_api_responses():
         "body TEXT"
         ")"
     )
-    conn.close()
+
+
+def migrate_monthly_rollup(conn):
+    """Ensure table for pre-aggregated monthly sales exists."""
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS monthly_rollup ("
+        "year INTEGER, "
+        "month INTEGER, "
+        "canonical_sku TEXT, "
+        "type TEXT, "
+        "source TEXT, "
+        "total REAL, "
+        "quantity REAL, "
+        "PRIMARY KEY (year, month, canonical_sku, type, source)"
+        ")"
+    )
+
+
+def migrate_data_version(conn):
+    """Ensure table for data change counters exists."""
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS data_version ("
+        "name TEXT PRIMARY KEY, "
+        "version INTEGER"
+        ")"
+    )
+
+
+def migrate_traffic_matrix_cache(conn):
+    """Ensure table for precomputed traffic matrices exists."""
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS traffic_matrix_cache ("
+        "year_limit INTEGER PRIMARY KEY, "
+        "version INTEGER, "
+        "built_at TEXT, "
+        "data TEXT"
+        ")"
+    )
+
+
+def get_data_version(name="reports", conn=None):
+    """Return the change counter for ``name``.
+
+    The ``reports`` counter is bumped by every write to the ``shopify``,
+    ``qbo``, ``sku_map`` and ``duplicate_log`` tables so cached report data
+    can be keyed on it. The ``hubspot`` counter tracks ``hubspot_traffic`` and
+    ``settings`` tracks the settings table. ``transactions`` is bumped by
+    every write to the ``shopify`` and ``qbo`` rows and ``rollup`` holds the
+    ``transactions`` version ``monthly_rollup`` was last brought up to date
+    with. ``database`` is not a counter but
+    a random id set when the database is created, so files kept next to it
+    can tell a recreated or restored database from the one they were built
+    from.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db()
+    row = conn.execute(
+        "SELECT version FROM data_version WHERE name=?", (name,)
+    ).fetchone()
+    if own_conn:
+        conn.close()
+    return row["version"] if row else 0
+
+
+def bump_data_version(conn=None, name="reports"):
+    """Increment the change counter for ``name``.
+
+    Pass the connection used for the write so the bump commits with it.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db()
+    conn.execute(
+        "INSERT INTO data_version(name, version) VALUES (?, 1) "
+        "ON CONFLICT(name) DO UPDATE SET version=version+1",
+        (name,),
+    )
+    if own_conn:
+        conn.commit()
+        conn.close()
+
+
+def ensure_transaction_indexes(conn):
+    """Create indexes on the Shopify and QBO transaction tables.
+
+    ``upload`` and the sync routes rebuild these tables with
+    ``DataFrame.to_sql(if_exists="replace")``, which drops their indexes, so
+    this runs after every such write as well as at startup.
+    """
+    for table in ("shopify", "qbo"):
+        cols = [
+            row["name"] for row in conn.execute(f"PRAGMA table_info({table})")
+        ]
+        if "created_ts" in cols:
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_created_ts "
+                f"ON {table}(created_ts)"
+            )
+        if "sku" in cols:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_sku ON {table}(sku)")
+        if "line_hash" in cols:
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_line_hash "
+                f"ON {table}(line_hash)"
+            )
+
+
+def ensure_line_hashes(conn, table):
+    """Ensure every row of ``table`` has a ``line_hash``.
+
+    Tables written by the API syncs or by older versions lack the column or
+    its values; in that case hashes are computed for the whole table in rowid
+    order, matching what uploading the same rows as one file would produce.
+    """
+    cols = [row["name"] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if not cols:
+        return
+    if "line_hash" not in cols:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN line_hash TEXT")
+    elif not conn.execute(
+        f"SELECT 1 FROM {table} WHERE line_hash IS NULL LIMIT 1"
+    ).fetchone():
+        return
+    select = ", ".join(["rowid AS _rowid"] + [c for c in HASH_COLUMNS if c in cols])
+    df = pd.read_sql_query(f"SELECT {select} FROM {table} ORDER BY rowid", conn)
+    if df.empty:
+        return
+    conn.executemany(
+        f"UPDATE {table} SET line_hash=? WHERE rowid=?",
+        zip(line_hashes(df), df["_rowid"].tolist()),
+    )
+
+
+def ensure_sku_keys(conn, table):
+    """Ensure every text SKU in ``table`` has its normalized ``sku_key``.
+
+    The key is the SKU lowercased and stripped, the form ``sku_map`` aliases
+    are stored in, so SQL can join the two on an index. Non-text SKUs keep a
+    NULL key. Only rows still missing a key are read, so calling this after
+    every write costs time proportional to the new rows.
+    """
+    cols = [row["name"] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if "sku" not in cols:
+        return
+    if "sku_key" not in cols:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN sku_key TEXT")
+    df = pd.read_sql_query(
+        f"SELECT rowid AS _rowid, sku FROM {table} "
+        "WHERE sku_key IS NULL AND typeof(sku)='text'",
+        conn,
+    )
+    if df.empty:
+        return
+    conn.executemany(
+        f"UPDATE {table} SET sku_key=? WHERE rowid=?",
+        zip(df["sku"].str.lower().str.strip(), df["_rowid"].tolist()),
+    )
+
+
+def index_duplicate_candidates(conn, table, rebuild=False):
+    """Add the match keys of new ``table`` rows to ``duplicate_candidates``.
+
+    Each dated row is keyed by its UTC day, numeric quantity and total and
+    its normalized SKU, the fields Shopify and QBO rows are compared on. Only
+    rows above the highest rowid already indexed for ``table`` are read, so
+    calling this after every write costs time proportional to the new rows.
+    ``rebuild`` drops the table's entries first, which is required after the
+    table is replaced because rowids start over.
+    """
+    if rebuild:
+        conn.execute("DELETE FROM duplicate_candidates WHERE source=?", (table,))
+    cols = [row["name"] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if "created_ts" not in cols:
+        return
+    after = conn.execute(
+        "SELECT COALESCE(MAX(row_id), 0) FROM duplicate_candidates WHERE source=?",
+        (table,),
+    ).fetchone()[0]
+    select = ", ".join(
+        ["rowid AS _rowid", "created_ts"]
+        + [c if c in cols else f"NULL AS {c}" for c in ("sku", "quantity", "total")]
+    )
+    df = pd.read_sql_query(
+        f"SELECT {select} FROM {table} "
+        "WHERE rowid > ? AND created_ts IS NOT NULL ORDER BY rowid",
+        conn,
+        params=(after,),
+    )
+    if df.empty:
+        return
+    sku = df["sku"].astype(object)
+    is_text = sku.map(type).eq(str)
+    sku = sku.where(~is_text, sku[is_text].str.lower().str.strip())
+    keys = pd.DataFrame(
+        {
+            "row_id": df["_rowid"],
+            "day": pd.to_numeric(df["created_ts"], errors="coerce") // 86400,
+            "quantity": pd.to_numeric(df["quantity"], errors="coerce"),
+            "total": pd.to_numeric(df["total"], errors="coerce"),
+            "sku_key": sku,
+        }
+    ).astype(object)
+    keys = keys.where(keys.notna(), None)
+    conn.executemany(
+        "INSERT OR REPLACE INTO duplicate_candidates"
+        "(source, row_id, day, quantity, total, sku_key) VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            (table, int(r[0]), r[1] if r[1] is None else int(r[1]), *r[2:])
+            for r in keys.itertuples(index=False, name=None)
+        ),
+    )
+
+
+# Secondary indexes for the lookups the app issues, as (name, table, columns)
+INDEXES = [
+    ("idx_sku_map_canonical", "sku_map", "canonical_sku"),
+    ("idx_duplicate_log_pair", "duplicate_log", "shopify_id, qbo_id, resolved_at"),
+    ("idx_duplicate_log_ignored", "duplicate_log", "ignored, resolved_at"),
+    ("idx_duplicate_log_action", "duplicate_log", "action"),
+    ("idx_app_log_logged_at", "app_log", "logged_at"),
+    ("idx_api_response_logged_at", "api_response", "logged_at"),
+]
+
+# Representative queries whose plans are compared when indexes are added
+HOT_QUERIES = {
+    "sku_map by canonical": ("SELECT alias FROM sku_map WHERE canonical_sku=?", ("",)),
+    "duplicate pair": (
+        "SELECT ignored FROM duplicate_log WHERE shopify_id=? AND qbo_id=? "
+        "ORDER BY resolved_at DESC LIMIT 1",
+        (0, 0),
+    ),
+    "ignored duplicates": (
+        "SELECT shopify_id, qbo_id FROM duplicate_log WHERE ignored=1",
+        (),
+    ),
+    "unmatched duplicates": (
+        "SELECT shopify_id, qbo_id FROM duplicate_log WHERE action='unmatched'",
+        (),
+    ),
+    "recent logs": (
+        "SELECT logged_at, message FROM app_log ORDER BY logged_at DESC LIMIT ?",
+        (100,),
+    ),
+    "recent api responses": (
+        "SELECT logged_at, endpoint FROM api_response ORDER BY logged_at DESC LIMIT ?",
+        (50,),
+    ),
+    "shopify date range": (
+        "SELECT sku, total FROM shopify WHERE created_ts >= ? AND created_ts <= ?",
+        (0, 0),
+    ),
+    "qbo date range": (
+        "SELECT sku, total FROM qbo WHERE created_ts >= ? AND created_ts <= ?",
+        (0, 0),
+    ),
+}
+
+
+def query_plans(conn):
+    """Return ``EXPLAIN QUERY PLAN`` details for each of ``HOT_QUERIES``."""
+    plans = {}
+    for label, (sql, params) in HOT_QUERIES.items():
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        plans[label] = "; ".join(row["detail"] for row in rows)
+    return plans
+
+
+def migrate_indexes(conn):
+    """Ensure secondary indexes exist, logging query plans that change.
+
+    Plans for ``HOT_QUERIES`` are captured before and after the missing
+    indexes are created, and each changed plan is written to ``app_log``.
+    """
+    before = query_plans(conn)
+    for name, table, columns in INDEXES:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})")
+    ensure_transaction_indexes(conn)
+    logged_at = datetime.now(timezone.utc).isoformat()
+    for label, plan in query_plans(conn).items():
+        if plan != before[label]:
+            conn.execute(
+                "INSERT INTO app_log(logged_at, message) VALUES (?, ?)",
+                (logged_at, f"Query plan for {label}: {before[label]} -> {plan}"),
+            )
+
+
+def migrate_created_ts(conn):
+    """Ensure transaction tables store parsed timestamps.
+
+    Adds ``created_ts`` (UTC epoch seconds), ``year`` and ``month`` columns to
+    ``shopify`` and ``qbo`` and fills them for existing rows so read paths
+    never have to parse ``created_at``.
+    """
+    for table in ("shopify", "qbo"):
+        cols = [
+            row["name"] for row in conn.execute(f"PRAGMA table_info({table})")
+        ]
+        if "created_ts" in cols:
+            continue
+        for col in ("created_ts", "year", "month"):
+            if col not in cols:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} INTEGER")
+        df = pd.read_sql_query(f"SELECT rowid AS id, created_at FROM {table}", conn)
+        if not df.empty:
+            df = normalize_created_at(df).astype(object)
+            df = df.where(df.notna(), None)
+            conn.executemany(
+                f"UPDATE {table} SET created_ts=?, year=?, month=? WHERE rowid=?",
+                df[["created_ts", "year", "month", "id"]].itertuples(
+                    index=False, name=None
+                ),
+            )
+    ensure_transaction_indexes(conn)
+
+
+def migrate_line_hash(conn):
+    """Ensure transaction tables carry hashed natural keys for appends."""
+    for table in ("shopify", "qbo"):
+        ensure_line_hashes(conn, table)
+    ensure_transaction_indexes(conn)
+
+
+def migrate_uploads(conn):
+    """Ensure the ledger of ingested upload files exists."""
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS uploads ("
+        "source TEXT, "
+        "sha256 TEXT, "
+        "filename TEXT, "
+        "rows INTEGER, "
+        "uploaded_at TEXT, "
+        "PRIMARY KEY (source, sha256)"
+        ")"
+    )
+
+
+def migrate_duplicate_candidates(conn):
+    """Ensure duplicate match keys are indexed for every transaction row.
+
+    ``sku_key`` has no declared type so non-text SKUs keep their stored
+    value and only match the same value, as they do when compared in pandas.
+    """
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS duplicate_candidates ("
+        "source TEXT, "
+        "row_id INTEGER, "
+        "day INTEGER, "
+        "quantity REAL, "
+        "total REAL, "
+        "sku_key, "
+        "PRIMARY KEY (source, row_id)"
+        ")"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_duplicate_candidates_key "
+        "ON duplicate_candidates(source, day, quantity, total)"
+    )
+    for table in ("shopify", "qbo"):
+        index_duplicate_candidates(conn, table)
+
+
+def migrate_duplicate_log_hash(conn):
+    """Ensure duplicate_log records the line hash of the row it deleted."""
+    cols = [
+        row["name"]
+        for row in conn.execute("PRAGMA table_info(duplicate_log)").fetchall()
+    ]
+    if "deleted_hash" not in cols:
+        conn.execute("ALTER TABLE duplicate_log ADD COLUMN deleted_hash TEXT")
+
+
+def migrate_database_id(conn):
+    """Ensure the database has a random ``database`` id in ``data_version``."""
+    conn.execute(
+        "INSERT OR IGNORE INTO data_version(name, version) VALUES ('database', ?)",
+        (secrets.randbits(62),),
+    )
+
+
+def migrate_rollup_stamp(conn):
+    """Start the ``transactions`` version ahead of the unstamped rollup.
+
+    Rollups written before the stamp existed may be stale, for example after
+    an interrupted sync, so they are rebuilt on first use.
+    """
+    conn.execute(
+        "INSERT OR IGNORE INTO data_version(name, version) "
+        "VALUES ('transactions', 1)"
+    )
+
+
+def migrate_sku_map_aliases(conn):
+    """Store every ``sku_map`` alias lowercased and stripped.
+
+    Every write already normalizes aliases, so duplicate matching joins row
+    SKU keys straight to the ``alias`` primary key. Older rows are rewritten
+    here; where several normalize to the same alias the earliest row wins, as
+    it did when the map was normalized on read.
+    """
+    seen = set()
+    deletes = []
+    updates = []
+    for row in conn.execute("SELECT rowid, alias FROM sku_map ORDER BY rowid"):
+        alias = row["alias"]
+        key = alias.lower().strip() if isinstance(alias, str) else alias
+        if key in seen:
+            deletes.append((row["rowid"],))
+            continue
+        seen.add(key)
+        if key != alias:
+            updates.append((key, row["rowid"]))
+    conn.executemany("DELETE FROM sku_map WHERE rowid=?", deletes)
+    conn.executemany("UPDATE sku_map SET alias=? WHERE rowid=?", updates)
+
+
+def migrate_sku_keys(conn):
+    """Ensure transaction rows carry the normalized SKU used for joins."""
+    for table in ("shopify", "qbo"):
+        ensure_sku_keys(conn, table)
+
+
+# Seconds between checks of the ``settings`` data version. Within that window
+# settings are read from memory only.
+SETTINGS_RECHECK_SECONDS = 2.0
+
+_settings_lock = threading.Lock()
+_settings_cache = {"values": None, "version": None, "checked": 0.0}
+
+
+def _cached_settings():
+    """Return the in-memory settings map, reloading it when out of date.
+
+    Every write bumps the ``settings`` data version, so another process
+    changing a setting is noticed at the next version check.
+    """
+    with _settings_lock:
+        now = time.monotonic()
+        cache = _settings_cache
+        if (
+            cache["values"] is not None
+            and now - cache["checked"] < SETTINGS_RECHECK_SECONDS
+        ):
+            return cache["values"]
+        conn = get_db()
+        version = get_data_version("settings", conn=conn)
+        if cache["values"] is None or cache["version"] != version:
+            cache["values"] = {
+                row["key"]: row["value"]
+                for row in conn.execute("SELECT key, value FROM settings")
+            }
+            cache["version"] = version
+        conn.close()
+        cache["checked"] = now
+        return cache["values"]
+
+
+def _cache_settings(pairs):
+    """Write ``pairs`` through to the in-memory settings map."""
+    with _settings_lock:
+        values = _settings_cache["values"]
+        if values is not None:
+            _settings_cache["values"] = {**values, **dict(pairs)}
+
+
+def _invalidate_settings():
+    """Drop the in-memory settings map so the next read reloads it."""
+    with _settings_lock:
+        _settings_cache["values"] = None
 
 
 def get_setting(key, default=""):
-    conn = get_db()
-    row = conn.execute("SELECT value FROM settings WHERE key=?", (key,)).fetchone()
-    conn.close()
-    return row["value"] if row else default
+    values = _cached_settings()
+    return values[key] if key in values else default
 
 
 def set_setting(key, value, conn=None):
@@ -272,27 +806,34 @@ def set_setting(key, value, conn=None):
         Existing database connection to use. When ``None``, a new connection
         is created for the operation. Providing a connection avoids opening a
         separate transaction and helps prevent ``database is locked`` errors
-        during long-running updates.
+        during long-running updates. The write is then only visible once
+        the caller commits, so the cached settings are dropped rather than
+        updated.
     """
 
     own_conn = conn is None
     if own_conn:
         conn = get_db()
     conn.execute("REPLACE INTO settings(key, value) VALUES (?, ?)", (key, value))
+    bump_data_version(conn, "settings")
     if own_conn:
         conn.commit()
         conn.close()
+        _cache_settings([(key, value)])
+    else:
+        _invalidate_settings()
 
 
 def set_settings(pairs):
     """Update multiple settings in a single transaction."""
-    conn = get_db()
-    conn.executemany(
-        "REPLACE INTO settings(key, value) VALUES (?, ?)",
-        pairs,
-    )
-    conn.commit()
-    conn.close()
+    pairs = list(pairs)
+    with db_session() as conn:
+        conn.executemany(
+            "REPLACE INTO settings(key, value) VALUES (?, ?)",
+            pairs,
+        )
+        bump_data_version(conn, "settings")
+    _cache_settings(pairs)
 
 
 def get_qbo_environment(default="prod"):
@@ -308,14 +849,19 @@ def set_qbo_environment(value):
     set_setting("qbo_environment", value)
 
 
-def add_log(message):
-    conn = get_db()
-    conn.execute(
-        "INSERT INTO app_log(logged_at, message) VALUES (?, ?)",
-        (datetime.now(timezone.utc).isoformat(), message),
-    )
-    conn.commit()
-    conn.close()
+def add_log(message, conn=None):
+    """Append ``message`` to ``app_log``.
+
+    When ``conn`` is given the row is written on that connection and left for
+    the caller to commit.
+    """
+    sql = "INSERT INTO app_log(logged_at, message) VALUES (?, ?)"
+    params = (datetime.now(timezone.utc).isoformat(), message)
+    if conn is not None:
+        conn.execute(sql, params)
+        return
+    with db_session() as conn:
+        conn.execute(sql, params)
 
 
 def get_logs(limit=100):
@@ -329,13 +875,11 @@ def get_logs(limit=100):
 
 
 def add_api_response(endpoint, status, body):
-    conn = get_db()
-    conn.execute(
-        "INSERT INTO api_response(logged_at, endpoint, status, body) VALUES (?, ?, ?, ?)",
-        (datetime.now(timezone.utc).isoformat(), endpoint, status, body),
-    )
-    conn.commit()
-    conn.close()
+    with db_session() as conn:
+        conn.execute(
+            "INSERT INTO api_response(logged_at, endpoint, status, body) VALUES (?, ?, ?, ?)",
+            (datetime.now(timezone.utc).isoformat(), endpoint, status, body),
+        )
 
 
 def get_api_responses(limit=50):
@@ -348,24 +892,8 @@ def get_api_responses(limit=50):
     return rows
 
 
-init_db()
-migrate_types()
-migrate_meta()
-migrate_sku_source()
-migrate_sku_changed()
-migrate_duplicate_log()
-migrate_shopify_orders()
-migrate_shopify_lines()
-migrate_qbo_docs()
-migrate_qbo_lines()
-migrate_app_log()
-migrate_hubspot_traffic()
-migrate_api_responses()
-
-
-def migrate_sync_tables():
+def migrate_sync_tables(conn):
     """Ensure tables for full sync data exist."""
-    conn = get_db()
     tables = {
         "shopify_orders": "shopify_id",
         "shopify_customers": "shopify_id",
@@ -379,7 +907,80 @@ def migrate_sync_tables():
         conn.execute(
             f"CREATE TABLE IF NOT EXISTS {name} ({pk} TEXT PRIMARY KEY, raw_json TEXT)"
         )
-    conn.close()
 
 
-migrate_sync_tables()
+# Schema migrations in the order they were introduced. Each one receives an
+# open connection inside the migration transaction and must be safe to run
+# against a database that already has its changes, since databases created
+# before ``schema_version`` existed start from zero. Append new migrations to
+# the end; never reorder or remove entries.
+MIGRATIONS = [
+    init_db,
+    migrate_types,
+    migrate_meta,
+    migrate_sku_source,
+    migrate_sku_changed,
+    migrate_duplicate_log,
+    migrate_shopify_orders,
+    migrate_shopify_lines,
+    migrate_qbo_docs,
+    migrate_qbo_lines,
+    migrate_app_log,
+    migrate_hubspot_traffic,
+    migrate_api_responses,
+    migrate_monthly_rollup,
+    migrate_data_version,
+    migrate_created_ts,
+    migrate_traffic_matrix_cache,
+    migrate_indexes,
+    migrate_sync_tables,
+    migrate_line_hash,
+    migrate_uploads,
+    migrate_duplicate_candidates,
+    migrate_database_id,
+    migrate_duplicate_log_hash,
+    migrate_rollup_stamp,
+    migrate_sku_map_aliases,
+    migrate_sku_keys,
+]
+
+
+def _schema_version(conn):
+    try:
+        row = conn.execute("SELECT version FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row["version"] if row else 0
+
+
+def run_migrations():
+    """Apply any ``MIGRATIONS`` newer than the recorded schema version.
+
+    An up-to-date database costs a single query. Otherwise the pending
+    migrations run in one transaction, so a failure leaves the schema and its
+    version unchanged.
+    """
+    conn = get_db()
+    try:
+        if _schema_version(conn) >= len(MIGRATIONS):
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # another process may have migrated while we waited for the lock
+            version = _schema_version(conn)
+            for migration in MIGRATIONS[version:]:
+                migration(conn)
+            conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER)")
+            conn.execute("DELETE FROM schema_version")
+            conn.execute(
+                "INSERT INTO schema_version(version) VALUES (?)", (len(MIGRATIONS),)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        conn.close()
+
+
+run_migrations()
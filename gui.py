@@ -1,3 +1,4 @@
+import multiprocessing
 import os
 import threading
 
@@ -11,6 +12,8 @@ def start_server():
 
 
 if __name__ == "__main__":
+    # lets the frozen Windows build start the upload parsing workers
+    multiprocessing.freeze_support()
     flask_thread = threading.Thread(target=start_server, daemon=True)
     flask_thread.start()
 
@@ -0,0 +1,61 @@
+import pandas as pd
+import pytest
+
+import app
+import database
+from utils.helpers import _load_staging
+from utils.ingest import line_hashes, normalize_created_at
+
+
+def _export(created_at, sku):
+    """Return a one-line normalized export like an upload would stage."""
+    df = normalize_created_at(
+        pd.DataFrame(
+            {
+                "created_at": [created_at],
+                "sku": [sku],
+                "description": ["Widget"],
+                "quantity": [2],
+                "price": [5.0],
+                "total": [10.0],
+            }
+        )
+    )
+    df["line_hash"] = line_hashes(df)
+    return df
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "finance.db"))
+    database.run_migrations()
+    conn = database.get_db()
+    for table, frame in (
+        ("shopify", _export("2024-03-05T10:15:00-05:00", "ABC-1 ")),
+        ("qbo", _export("2024-03-05", "abc-1")),
+    ):
+        frame.to_sql(table, conn, if_exists="replace", index=False)
+        database.ensure_sku_keys(conn, table)
+        database.index_duplicate_candidates(conn, table, rebuild=True)
+    app._rebuild_rollup(conn)
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def test_unmatched_row_is_not_appended_again(conn):
+    client = app.app.test_client()
+    response = client.post("/resolve-duplicates", json={"pairs": [[1, 1, "qbo"]]})
+    assert response.json["deleted"] == {"qbo": 0, "shopify": 1}
+    response = client.post("/unmatch-duplicate", data={"shopify_id": 1, "qbo_id": 1})
+    assert response.json["success"]
+
+    export = _export("2024-03-05T10:15:00-05:00", "ABC-1 ")
+    restored = conn.execute("SELECT created_at, sku, line_hash FROM shopify").fetchall()
+    assert [tuple(row) for row in restored] == [
+        ("2024-03-05T10:15:00-05:00", "ABC-1 ", export["line_hash"][0])
+    ]
+
+    export.to_sql("shopify_staging", conn, index=False)
+    assert _load_staging(conn, "shopify", "shopify_staging", append=True) == 0
+    assert conn.execute("SELECT COUNT(*) FROM shopify").fetchone()[0] == 1
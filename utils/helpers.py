@@ -1,14 +1,20 @@
 # Helper functions extracted from app.py for reusability
+import codecs
+import hashlib
+import itertools
 import os
+from collections import Counter
 import time
 import requests
 from datetime import datetime
 from io import BytesIO
 import json
+import openpyxl
 import pandas as pd
 from markupsafe import Markup
 
-from database import add_api_response, add_log, get_setting
+from database import add_api_response, add_log, ensure_line_hashes, get_setting
+from .ingest import line_hashes, normalize_created_at
 
 DEFAULT_THEME_PRIMARY = "#1976d2"
 DEFAULT_THEME_HIGHLIGHT = "#bbdefb"
@@ -40,27 +46,79 @@ def _chart_style():
     return "dark_background" if _is_dark_color(bg) else "default"
 
 
-def _try_read_csv(data: bytes, encodings=None) -> pd.DataFrame:
-    """Try reading CSV bytes with a series of encodings."""
-    encodings = encodings or ["utf-8", "utf-8-sig", "utf-16", "latin-1", "cp1252"]
-    for enc in encodings:
-        try:
-            return pd.read_csv(BytesIO(data), encoding=enc)
-        except Exception:
-            continue
-    raise ValueError("Unsupported CSV encoding")
+# Bytes read from the start of a CSV upload to detect its encoding.
+ENCODING_SAMPLE_BYTES = 64 * 1024
+
+_BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+
+class CSVEncodingError(ValueError):
+    """Raised when a CSV does not decode with its detected encoding."""
+
+
+def _detect_encoding(sample: bytes) -> str:
+    """Return the encoding for a CSV that starts with ``sample``.
+
+    A byte order mark decides the encoding outright. Otherwise the sample is
+    tried as UTF-8 (allowing a character cut off at the end of the sample),
+    then cp1252, falling back to latin-1, which accepts any bytes.
+    """
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    try:
+        sample.decode("cp1252")
+        return "cp1252"
+    except UnicodeDecodeError:
+        return "latin-1"
+
 
+def _try_read_csv(data: bytes, log=None) -> pd.DataFrame:
+    """Read CSV bytes in the encoding detected from their first bytes.
 
-def _parse_shopify(file_storage) -> pd.DataFrame:
+    ``log`` is called with a message naming the detected encoding.
+    """
+    encoding = _detect_encoding(data[:ENCODING_SAMPLE_BYTES])
+    if log:
+        log(f"detected {encoding} encoding")
+    try:
+        return pd.read_csv(BytesIO(data), encoding=encoding)
+    except UnicodeDecodeError as exc:
+        raise CSVEncodingError(
+            f"File is not valid {encoding} at byte {exc.start}; "
+            "save it as UTF-8 and upload it again"
+        ) from exc
+
+
+def _parse_shopify(file_storage, log=None) -> pd.DataFrame:
     data = file_storage.read()
     file_storage.seek(0)
     try:
-        df = _try_read_csv(data)
-    except Exception:
+        df = _try_read_csv(data, log)
+    except Exception as csv_exc:
         try:
             df = pd.read_excel(BytesIO(data))
         except Exception as exc:
+            if isinstance(csv_exc, CSVEncodingError):
+                raise csv_exc from exc
             raise ValueError("Could not parse Shopify file") from exc
+    return _clean_shopify(df)
+
+
+def _clean_shopify(df: pd.DataFrame, counts=None) -> pd.DataFrame:
+    """Return the normalized transaction columns of a Shopify export.
+
+    ``counts`` is passed to ``line_hashes`` when cleaning a file in chunks.
+    """
     required = {"Created at", "Lineitem sku"}
     if not required.issubset(set(df.columns)):
         raise ValueError("Invalid Shopify data")
@@ -77,38 +135,260 @@ def _parse_shopify(file_storage) -> pd.DataFrame:
         0
     ) * pd.to_numeric(df["Lineitem quantity"], errors="coerce").fillna(0)
     cleaned.columns = ["created_at", "sku", "description", "quantity", "price", "total"]
+    cleaned = normalize_created_at(cleaned)
+    cleaned["line_hash"] = line_hashes(cleaned, counts)
     return cleaned
 
 
-def _parse_qbo(file_storage) -> pd.DataFrame:
-    data = file_storage.read()
+def _stream_shopify(
+    file_storage, conn, staging, chunksize=50_000, progress=None, log=None
+) -> int:
+    """Stage a Shopify CSV in table ``staging`` without holding the whole file.
+
+    The upload is read ``chunksize`` rows at a time and each chunk is cleaned
+    and appended to the staging table, so memory use is bounded by the chunk
+    size. The caller moves the rows into ``shopify`` with ``_load_staging``.
+    ``progress`` is called with ``(chunk_number, rows_so_far)`` after each
+    chunk and ``log`` with the detected encoding. Returns the rows staged.
+    """
+    file_storage.seek(0)
+    encoding = _detect_encoding(file_storage.read(ENCODING_SAMPLE_BYTES))
+    if log:
+        log(f"detected {encoding} encoding")
     file_storage.seek(0)
+    counts = Counter()
     try:
-        df = pd.read_excel(BytesIO(data), skiprows=4)
-    except Exception:
-        try:
-            df = _try_read_csv(data)
-        except Exception as exc:
-            raise ValueError("Could not parse QuickBooks file") from exc
-    expected = {"transaction_date", "product_service"}
-    if set(df.columns[:2]).intersection(expected) != expected:
+        reader = pd.read_csv(file_storage, encoding=encoding, chunksize=chunksize)
+        chunks = (_clean_shopify(chunk, counts) for chunk in reader)
+        rows = _stage_chunks(chunks, conn, staging, progress)
+    except UnicodeDecodeError as exc:
+        raise CSVEncodingError(
+            f"File is not valid {encoding}; save it as UTF-8 and upload it again"
+        ) from exc
+    finally:
+        file_storage.seek(0)
+    if not rows:
+        raise ValueError("Invalid Shopify data")
+    return rows
+
+
+def _stage_chunks(chunks, conn, staging, progress=None) -> int:
+    """Write cleaned ``chunks`` to table ``staging``, replacing it.
+
+    ``progress`` is called with ``(chunk_number, rows_so_far)`` after each
+    chunk. Returns the number of rows written.
+    """
+    rows = 0
+    for number, chunk in enumerate(chunks, start=1):
+        chunk.to_sql(
+            staging,
+            conn,
+            if_exists="replace" if number == 1 else "append",
+            index=False,
+        )
+        rows += len(chunk)
+        if progress:
+            progress(number, rows)
+    return rows
+
+
+def _load_staging(conn, table, staging, append=False) -> int:
+    """Move the rows of table ``staging`` into ``table``.
+
+    By default the staging table replaces ``table``. With ``append`` only
+    rows whose ``line_hash`` is not already present, and was not deleted by
+    resolving a duplicate, are inserted, leaving existing rows and their
+    rowids untouched. Runs inside the caller's transaction and returns the
+    number of rows added.
+    """
+    if not conn.in_transaction:
+        conn.execute("BEGIN")
+    existing = [row["name"] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if not append or not existing:
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(f"ALTER TABLE {staging} RENAME TO {table}")
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    ensure_line_hashes(conn, table)
+    staged = [row["name"] for row in conn.execute(f"PRAGMA table_info({staging})")]
+    cols = ", ".join(f'"{c}"' for c in staged if c in existing or c == "line_hash")
+    # a duplicate resolved with action "qbo" deleted the Shopify row and
+    # vice versa; unmatching it restores the row with that same line_hash and
+    # sets the action to "unmatched"
+    kept = "qbo" if table == "shopify" else "shopify"
+    cur = conn.execute(
+        f"INSERT INTO {table}({cols}) SELECT {cols} FROM {staging} "
+        f"WHERE line_hash NOT IN "
+        f"(SELECT line_hash FROM {table} WHERE line_hash IS NOT NULL) "
+        "AND line_hash NOT IN (SELECT deleted_hash FROM duplicate_log "
+        "WHERE action=? AND deleted_hash IS NOT NULL) "
+        "ORDER BY rowid",
+        (kept,),
+    )
+    conn.execute(f"DROP TABLE {staging}")
+    return cur.rowcount
+
+
+def _drop_staging(conn) -> None:
+    """Drop staging tables left behind by an upload that failed."""
+    names = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name GLOB '*_staging*'"
+    ).fetchall()
+    for (name,) in names:
+        conn.execute(f'DROP TABLE "{name}"')
+
+
+def _file_digest(file_storage) -> str:
+    """Return the SHA-256 hex digest of an uploaded file's contents."""
+    digest = hashlib.sha256()
+    file_storage.seek(0)
+    for block in iter(lambda: file_storage.read(1024 * 1024), b""):
+        digest.update(block)
+    file_storage.seek(0)
+    return digest.hexdigest()
+
+
+def _read_sku_map(file, filename) -> pd.DataFrame:
+    """Read an uploaded SKU map file, checking its required columns."""
+    try:
+        if filename.lower().endswith((".xls", ".xlsx")):
+            df = pd.read_excel(file)
+        else:
+            df = pd.read_csv(file)
+    except Exception as exc:
+        raise ValueError("Unable to parse SKU map file.") from exc
+    required = {"alias", "canonical_sku", "type"}
+    if not required.issubset(df.columns):
+        raise ValueError(
+            "SKU map file must contain alias, canonical_sku and type columns."
+        )
+    return df
+
+
+def _parse_upload(source, filename, data):
+    """Parse one uploaded file; run in a worker process by ``upload``.
+
+    Returns ``(frame, messages, seconds)`` where ``messages`` are the log
+    lines produced while parsing, since the worker cannot write to the
+    upload's connection.
+    """
+    start = time.perf_counter()
+    messages = []
+    buffer = BytesIO(data)
+    if source == "shopify":
+        df = _parse_shopify(buffer, messages.append)
+    elif source == "qbo":
+        df = _parse_qbo(buffer, messages.append)
+    else:
+        df = _read_sku_map(buffer, filename)
+    return df, messages, time.perf_counter() - start
+
+
+# Column names of a QuickBooks sales detail export, in sheet order.
+QBO_COLUMNS = [
+    "deleted_code",
+    "transaction_date",
+    "transaction_type",
+    "transaction_number",
+    "customer_name",
+    "line_description",
+    "quantity",
+    "sales_price",
+    "amount",
+    "balance",
+    "product_service",
+]
+# Rows searched for the header of a QuickBooks export, and the header row
+# assumed when none is recognized (reports start with four title rows).
+QBO_HEADER_SCAN_ROWS = 20
+QBO_DEFAULT_HEADER_ROW = 4
+
+
+def _qbo_columns(header) -> list:
+    """Return column names for a QuickBooks export with ``header``.
+
+    Files that already use ``transaction_date``/``product_service`` names
+    keep them; anything else must have the standard layout and gets
+    ``QBO_COLUMNS`` by position.
+    """
+    names = [str(name) for name in header]
+    if set(names[:2]) == {"transaction_date", "product_service"}:
+        return names
+    if len(names) != len(QBO_COLUMNS):
+        raise ValueError("Invalid QuickBooks data")
+    return list(QBO_COLUMNS)
+
+
+def _is_qbo_header(row) -> bool:
+    labels = {
+        str(cell).strip().lower().replace(" ", "_").replace("/", "_")
+        for cell in row
+        if cell is not None
+    }
+    return "transaction_date" in labels
+
+
+def _open_excel_rows(file):
+    """Return an iterator over the cell values of a workbook's first sheet.
+
+    The workbook is opened in openpyxl's read-only mode, which parses rows as
+    they are iterated instead of loading the whole sheet, and closed once
+    the rows are exhausted or the iterator is discarded. Raises if ``file``
+    is not an Excel workbook.
+    """
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+
+    def rows():
         try:
-            df.columns = [
-                "deleted_code",
-                "transaction_date",
-                "transaction_type",
-                "transaction_number",
-                "customer_name",
-                "line_description",
-                "quantity",
-                "sales_price",
-                "amount",
-                "balance",
-                "product_service",
-            ]
-        except ValueError as exc:
-            raise ValueError("Invalid QuickBooks data") from exc
-    df = df[df.get("transaction_date").notna()]
+            yield from workbook.worksheets[0].iter_rows(values_only=True)
+        finally:
+            workbook.close()
+
+    return rows()
+
+
+def _qbo_chunks(rows, chunksize=50_000):
+    """Yield raw QuickBooks line frames of up to ``chunksize`` rows.
+
+    The header is the first of the leading rows that names a transaction
+    date, falling back to ``QBO_DEFAULT_HEADER_ROW``. Only the columns that
+    ``_clean_qbo`` uses are kept.
+    """
+    leading = list(itertools.islice(rows, QBO_HEADER_SCAN_ROWS))
+    index = next(
+        (i for i, row in enumerate(leading) if _is_qbo_header(row)),
+        QBO_DEFAULT_HEADER_ROW,
+    )
+    if index >= len(leading):
+        raise ValueError("Invalid QuickBooks data")
+    names = _qbo_columns(leading[index])
+    wanted = [
+        i
+        for i, name in enumerate(names)
+        if name
+        in {"transaction_date", "line_description", "quantity", "sales_price", "amount"}
+        or name.lower().replace(" ", "_") == "sku"
+    ]
+    columns = [names[i] for i in wanted]
+    body = itertools.chain(leading[index + 1 :], rows)
+    first = True
+    while True:
+        batch = [
+            [row[i] if i < len(row) else None for i in wanted]
+            for row in itertools.islice(body, chunksize)
+        ]
+        if not batch and not first:
+            return
+        first = False
+        yield pd.DataFrame(batch, columns=columns)
+
+
+def _clean_qbo(df: pd.DataFrame, counts=None) -> pd.DataFrame:
+    """Return the normalized transaction columns of QuickBooks lines.
+
+    Rows without a transaction date (section totals and blank lines) are
+    dropped. ``counts`` is passed to ``line_hashes`` for chunked files.
+    """
+    df = df[df.get("transaction_date").notna()].copy()
     sku_col = next(
         (c for c in df.columns if c.lower().replace(" ", "_") == "sku"), None
     )
@@ -127,9 +407,49 @@ def _parse_qbo(file_storage) -> pd.DataFrame:
         ]
     ].copy()
     cleaned.columns = ["created_at", "sku", "description", "quantity", "price", "total"]
+    cleaned = normalize_created_at(cleaned)
+    cleaned["line_hash"] = line_hashes(cleaned, counts)
     return cleaned
 
 
+def _parse_qbo(file_storage, log=None) -> pd.DataFrame:
+    data = file_storage.read()
+    file_storage.seek(0)
+    try:
+        rows = _open_excel_rows(BytesIO(data))
+    except Exception:
+        try:
+            df = _try_read_csv(data, log)
+        except CSVEncodingError:
+            raise
+        except Exception as exc:
+            raise ValueError("Could not parse QuickBooks file") from exc
+        df.columns = _qbo_columns(df.columns)
+    else:
+        df = pd.concat(list(_qbo_chunks(rows)), ignore_index=True)
+    return _clean_qbo(df)
+
+
+def _stream_qbo(file_storage, conn, staging, chunksize=50_000, progress=None) -> int:
+    """Stage a QuickBooks workbook in table ``staging`` chunk by chunk.
+
+    Rows are read in openpyxl's read-only mode and cleaned ``chunksize`` at
+    a time, so memory use is bounded by the chunk size. The caller moves the
+    rows into ``qbo`` with ``_load_staging``. Returns the rows staged.
+    """
+    file_storage.seek(0)
+    try:
+        counts = Counter()
+        chunks = (
+            _clean_qbo(chunk, counts)
+            for chunk in _qbo_chunks(_open_excel_rows(file_storage), chunksize)
+        )
+        rows = _stage_chunks(chunks, conn, staging, progress)
+    finally:
+        file_storage.seek(0)
+    if not rows:
+        raise ValueError("Invalid QuickBooks data")
+    return rows
 
 
 def format_dt(value):
@@ -0,0 +1,73 @@
+"""Normalization applied to transaction rows when they are ingested."""
+
+from __future__ import annotations
+
+import hashlib
+from collections import Counter
+
+import pandas as pd
+
+EPOCH = pd.Timestamp("1970-01-01", tz="UTC")
+# natural key of a transaction line, hashed into ``line_hash``
+HASH_COLUMNS = ("created_ts", "sku", "description", "quantity", "total")
+
+
+def normalize_created_at(df: pd.DataFrame) -> pd.DataFrame:
+    """Return ``df`` with parsed ``created_ts``, ``year`` and ``month`` columns.
+
+    ``created_ts`` holds the UTC epoch in seconds; ``year`` and ``month`` are
+    taken from the UTC timestamp. The raw ``created_at`` value is kept for
+    display. Unparseable timestamps produce nulls in all three columns.
+    """
+    out = df.copy()
+    if "created_at" not in out.columns:
+        return out
+    parsed = pd.to_datetime(
+        out["created_at"].astype(str), errors="coerce", format="mixed", utc=True
+    )
+    out["created_ts"] = ((parsed - EPOCH) // pd.Timedelta(seconds=1)).astype("Int64")
+    out["year"] = parsed.dt.year.astype("Int64")
+    out["month"] = parsed.dt.month.astype("Int64")
+    return out
+
+
+def created_datetime(created_ts: pd.Series) -> pd.Series:
+    """Return naive UTC datetimes for a ``created_ts`` column."""
+    return pd.to_datetime(created_ts, unit="s", errors="coerce")
+
+
+def timestamp_parts(value) -> tuple:
+    """Return ``(created_ts, year, month)`` for a single ``created_at`` value."""
+    row = normalize_created_at(pd.DataFrame({"created_at": [value]})).iloc[0]
+    return tuple(
+        None if pd.isna(row[col]) else int(row[col])
+        for col in ("created_ts", "year", "month")
+    )
+
+
+def line_hashes(df: pd.DataFrame, counts: Counter | None = None) -> pd.Series:
+    """Return a SHA-1 ``line_hash`` for each row of a normalized frame.
+
+    The hash covers ``HASH_COLUMNS`` plus the row's occurrence number among
+    identical keys, so genuinely repeated lines in one export stay distinct
+    while the same export uploaded twice produces the same hashes. Quantities
+    and totals are compared as floats so ``2`` and ``2.0`` agree. Pass a
+    shared ``counts`` when hashing a file in chunks to continue the
+    occurrence numbers from earlier chunks.
+    """
+    parts = []
+    for col in HASH_COLUMNS:
+        values = df[col] if col in df.columns else pd.Series(None, index=df.index)
+        if col in ("quantity", "total"):
+            values = pd.to_numeric(values, errors="coerce").astype(float)
+        elif col == "created_ts":
+            values = pd.to_numeric(values, errors="coerce").astype("Int64")
+        parts.append(values.astype(object).where(values.notna(), "").astype(str))
+    key = parts[0].str.cat(parts[1:], sep="\x1f")
+    occurrence = key.groupby(key).cumcount()
+    if counts is not None:
+        occurrence += key.map(counts).fillna(0).astype(int)
+        counts.update(key.value_counts().to_dict())
+    return (key + "\x1f" + occurrence.astype(str)).map(
+        lambda value: hashlib.sha1(value.encode("utf-8")).hexdigest()
+    )
@@ -7,6 +7,7 @@ from dataclasses import dataclass
 import pandas as pd
 import requests
 
+from .ingest import normalize_created_at
 from .master_fields import apply_master_fields
 
 
@@ -96,7 +97,7 @@ class QBOClient:
                 )
                 lines.append({"doc_id": doc_id, "line_num": idx, "data": line})
 
-        df = pd.DataFrame(rows)
+        df = normalize_created_at(pd.DataFrame(rows))
         df = apply_master_fields(df, "qbo")
         next_pos = start_pos + 1000 if len(docs) == 1000 else None
         item_map = item_map or {}
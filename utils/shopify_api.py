@@ -7,6 +7,7 @@ from dataclasses import dataclass
 import pandas as pd
 import requests
 
+from .ingest import normalize_created_at
 from .master_fields import apply_master_fields
 
 
@@ -65,7 +66,7 @@ class ShopifyClient:
                     }
                 )
 
-        df = pd.DataFrame(rows)
+        df = normalize_created_at(pd.DataFrame(rows))
         df = apply_master_fields(df, "shopify")
         next_cursor = resp.links.get("next", {}).get("url")
         return df, orders, line_items, next_cursor
@@ -0,0 +1,130 @@
+"""Memory-mapped columnar snapshots of the transaction tables.
+
+Each snapshot holds typed NumPy arrays for the ``shopify`` and ``qbo``
+tables written with ``np.save`` and reopened with ``mmap_mode="r"``, so
+every request thread shares the same read-only pages instead of holding its
+own DataFrame copy. SKUs are dictionary encoded: ``sku`` stores an index into
+the ``skus`` list kept in the snapshot metadata, with ``-1`` for missing
+values. Snapshots are keyed on the database id as well as the data version,
+since the version counter starts over in a new database.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+SOURCES = ("shopify", "qbo")
+COLUMNS = ("rowid", "created_ts", "year", "month", "total", "quantity", "sku")
+# sentinel stored in created_ts when the timestamp could not be parsed
+MISSING_TS = np.iinfo(np.int64).min
+
+_lock = threading.Lock()
+_open: dict = {}
+
+
+class Snapshot:
+    """Read-only columns for one database and data version."""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as fh:
+            meta = json.load(fh)
+        self.path = path
+        self.version = meta["version"]
+        self.database = meta["database"]
+        self.skus = {src: meta["skus"][src] for src in SOURCES}
+        self.columns = {
+            src: {
+                col: np.load(os.path.join(path, f"{src}.{col}.npy"), mmap_mode="r")
+                for col in COLUMNS
+            }
+            for src in SOURCES
+        }
+
+    def __len__(self) -> int:
+        return sum(len(self.columns[src]["rowid"]) for src in SOURCES)
+
+
+def _encode(conn, source: str) -> tuple[dict, list]:
+    df = pd.read_sql_query(
+        "SELECT rowid, created_ts, year, month, total, quantity, sku "
+        f"FROM {source} ORDER BY rowid",
+        conn,
+    )
+    codes, uniques = pd.factorize(df["sku"])
+    arrays = {
+        "rowid": df["rowid"].to_numpy(dtype=np.int64),
+        "created_ts": pd.to_numeric(df["created_ts"], errors="coerce")
+        .fillna(MISSING_TS)
+        .to_numpy(dtype=np.int64),
+        "year": pd.to_numeric(df["year"], errors="coerce")
+        .fillna(0)
+        .to_numpy(dtype=np.int16),
+        "month": pd.to_numeric(df["month"], errors="coerce")
+        .fillna(0)
+        .to_numpy(dtype=np.int8),
+        "total": pd.to_numeric(df["total"], errors="coerce").to_numpy(
+            dtype=np.float64
+        ),
+        "quantity": pd.to_numeric(df["quantity"], errors="coerce").to_numpy(
+            dtype=np.float64
+        ),
+        "sku": codes.astype(np.int32),
+    }
+    skus = [v.item() if isinstance(v, np.generic) else v for v in uniques]
+    return arrays, skus
+
+
+def _name(version: int, database: int) -> str:
+    return f"v{version}-{database:x}"
+
+
+def write_snapshot(conn, directory: str, version: int, database: int) -> str:
+    """Write a snapshot of the transaction tables for ``version``.
+
+    Files are written to a temporary directory and renamed into place so
+    readers never see a partial snapshot. Returns the snapshot path.
+    """
+    path = os.path.join(directory, _name(version, database))
+    tmp = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    os.makedirs(tmp, exist_ok=True)
+    skus = {}
+    for source in SOURCES:
+        arrays, skus[source] = _encode(conn, source)
+        for col, values in arrays.items():
+            np.save(os.path.join(tmp, f"{source}.{col}.npy"), values)
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as fh:
+        json.dump({"version": version, "database": database, "skus": skus}, fh)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # another worker finished the same version first
+        shutil.rmtree(tmp, ignore_errors=True)
+    return path
+
+
+def load_snapshot(conn, directory: str, version: int, database: int) -> Snapshot:
+    """Return the snapshot for ``version`` of ``database``, writing it if needed.
+
+    Opened snapshots are shared across threads. Other snapshots are dropped
+    from memory and removed from disk once the requested one is available.
+    """
+    name = _name(version, database)
+    with _lock:
+        snap = _open.get(directory)
+        if snap is not None and (snap.version, snap.database) == (version, database):
+            return snap
+        path = os.path.join(directory, name)
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            write_snapshot(conn, directory, version, database)
+        snap = Snapshot(path)
+        _open[directory] = snap
+        for other in os.listdir(directory):
+            if other != name and other.startswith("v") and ".tmp-" not in other:
+                shutil.rmtree(os.path.join(directory, other), ignore_errors=True)
+        return snap